@@ -0,0 +1,379 @@
+import asyncio
+import json
+import logging
+import os
+import httpx
+from langchain_core.output_parsers import StrOutputParser
+from retrieval import select_context, default_tokenizer
+from rerank import rerank_context
+from lab_analysis import describe_report, LOCAL_REPORT_ANALYSIS
+from llm_cache import LLM_CACHE_MODE
+from reference_ranges import analyze_report
+from functions import (
+    remove_tags,
+    ThinkTagStripper,
+    only_p_tags,
+    encode_texts,
+    query_index,
+    prepare_chunks,
+    clean_text,
+    interpretation_messages,
+    summarize_prompt,
+    batch_by_tokens,
+    truncate_to_budget,
+    is_unhelpful,
+    SUMMARY_MAX_DEPTH,
+    refined_prompt,
+    discard_prompt,
+    final_output_prompt,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Global limits shared by every in-flight request of this worker, so a burst of
+# reports queues here instead of exhausting Groq rate limits or sockets.
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "64"))
+MAX_CONCURRENT_FETCHES = int(os.getenv("MAX_CONCURRENT_FETCHES", "32"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "20"))
+# Per-request fan-out for page fetches and chunk extraction.
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+
+llm_semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+fetch_semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+_http_client = None
+
+
+def get_http_client():
+    """Return the worker-wide AsyncClient, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=MAX_CONCURRENT_FETCHES),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one in-flight task.
+
+    Callers that arrive while a task for their key is running await the
+    same result. The task is shielded, so a caller that disconnects does
+    not cancel the work the others are waiting on.
+    """
+
+    def __init__(self):
+        self.calls = {}
+
+    def __contains__(self, key):
+        return key in self.calls
+
+    async def do(self, key, func):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self.calls[key] = task
+            task.add_done_callback(lambda finished: self._forget(key, finished))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+
+
+async def ainvoke_text(chat, prompt):
+    async with llm_semaphore:
+        chain = chat | StrOutputParser()
+        response = await chain.ainvoke(prompt)
+    return remove_tags(response)
+
+
+async def ascrape_and_extract(url):
+    try:
+        async with fetch_semaphore:
+            response = await get_http_client().get(url, headers=HEADERS)
+        response.raise_for_status()
+        return response.text
+    except httpx.HTTPError as e:
+        logging.error(f"Error fetching {url}: {e}")
+        return None
+
+
+async def aget_URLs(test_name, SERPER_API_KEY):
+    search_query = f"How to interpret {test_name} report"
+    payload = json.dumps({"q": search_query, "num": 2})
+    headers = {'X-API-KEY': SERPER_API_KEY, 'Content-Type': 'application/json'}
+    url = "https://google.serper.dev/search"
+    try:
+        async with fetch_semaphore:
+            response = await get_http_client().post(url, headers=headers, content=payload)
+        response.raise_for_status()
+        data = response.json()
+        urls = [entry["link"] for entry in data.get("organic", [])]
+        logging.info(f"URLs:, {urls}")
+        return urls
+    except httpx.HTTPError as e:
+        logging.error(f"Error fetching URLs: {e}")
+        return []
+
+
+async def amap_bounded(func, items, limit):
+    """Run ``func`` over ``items`` with at most ``limit`` calls in flight.
+
+    Results come back in input order; a failing item yields its exception
+    instead of cancelling the rest of the batch.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+
+async def aextract_chunk_interpretation(chunk, test_name, chat):
+    messages = interpretation_messages(chunk, test_name)
+    async with llm_semaphore:
+        response = await chat.ainvoke(messages)
+    return remove_tags(response.content)
+
+
+async def aget_interpretations_list(test_name, urls, chat, tokenizer, max_tokens, concurrency=CHUNK_CONCURRENCY, chunk_gate=None):
+    pages = await amap_bounded(ascrape_and_extract, urls, concurrency)
+
+    fetched = []
+    for url, content in zip(urls, pages):
+        if isinstance(content, Exception):
+            logging.error(f"Error fetching {url}: {content}")
+            continue
+        if content:
+            fetched.append((url, content))
+
+    async def clean(page):
+        url, content = page
+        # BeautifulSoup parsing is CPU bound, keep it off the event loop.
+        return await asyncio.to_thread(clean_text, content, url)
+
+    extracted_texts = []
+    for (url, _), cleaned_text in zip(fetched, await amap_bounded(clean, fetched, concurrency)):
+        if isinstance(cleaned_text, Exception):
+            logging.error(f"Error cleaning {url}: {cleaned_text}")
+            continue
+        extracted_texts.append(cleaned_text)
+
+    web_content_chunks = await asyncio.to_thread(prepare_chunks, test_name, extracted_texts, tokenizer, max_tokens)
+
+    async def extract(chunk):
+        return await aextract_chunk_interpretation(chunk, test_name, chat)
+
+    decisions = ["keep"] * len(web_content_chunks)
+    if chunk_gate is not None:
+        decisions = await asyncio.to_thread(chunk_gate.select, test_name, web_content_chunks)
+    sent = [(chunk, decision) for chunk, decision in zip(web_content_chunks, decisions) if decision != "skip"]
+
+    results = await amap_bounded(extract, [chunk for chunk, _ in sent], concurrency)
+    responses = []
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            logging.error(f"Error extracting chunk {i + 1}/{len(results)} for {test_name}: {result}")
+            continue
+        responses.append(result)
+    if chunk_gate is not None:
+        chunk_gate.record(test_name, [decision for _, decision in sent], [None if isinstance(r, Exception) else r for r in results])
+    return responses
+
+
+async def asummarize_web_content(list_of_interpretations, test_name, chat, tokenizer=None, max_depth=SUMMARY_MAX_DEPTH):
+    """Tree-reduce summary: drop empty extractions, summarize token-budgeted batches concurrently, repeat until one batch is left.
+
+    Each level cuts the number of inputs by up to SUMMARY_FAN_IN, so the
+    prompt never outgrows SUMMARY_BATCH_TOKENS however many chunks the
+    pages produced. Past max_depth the remaining inputs are truncated to
+    one batch.
+    """
+    tokenizer = tokenizer or default_tokenizer()
+
+    async def summarize(batch):
+        return await ainvoke_text(chat, summarize_prompt(batch, test_name))
+
+    texts = [text for text in list_of_interpretations if not is_unhelpful(text)]
+    for depth in range(max_depth):
+        batches = batch_by_tokens(texts, tokenizer)
+        if len(batches) <= 1:
+            break
+        logging.info(f"Summary level {depth + 1} for {test_name}: {len(texts)} inputs in {len(batches)} batches")
+        summaries = await asyncio.gather(*(summarize(batch) for batch in batches), return_exceptions=True)
+        texts = []
+        for i, summary in enumerate(summaries):
+            if isinstance(summary, Exception):
+                logging.error(f"Error summarizing batch {i + 1}/{len(batches)} for {test_name}: {summary}")
+                continue
+            if not is_unhelpful(summary):
+                texts.append(summary)
+    if not texts:
+        return ""
+    kept = truncate_to_budget(texts, tokenizer)
+    if len(kept) < len(texts):
+        dropped = texts[len(kept):]
+        logging.warning(
+            f"Summary for {test_name} reached depth {max_depth}: dropped {len(dropped)} of {len(texts)} inputs "
+            f"({sum(len(tokenizer.encode(text)) for text in dropped)} tokens) to fit the final batch"
+        )
+    return await summarize(kept)
+
+
+async def agenerate_refined_prompt(query, type, disease, chat):
+    response = await ainvoke_text(chat, refined_prompt(query, type, disease))
+    return only_p_tags(response)
+
+
+async def adiscard_irrelevant_context(test_name, normal_ranges, retrieved_context, report, web_content, chat):
+    prompt = discard_prompt(test_name, normal_ranges, retrieved_context, report, web_content)
+    return await ainvoke_text(chat, prompt)
+
+
+async def afilter_context(test_name, normal_ranges, retrieved_context, report, web_content, chat, reranker=None):
+    """Discard irrelevant context with the LLM, or locally when a reranker is configured."""
+    if reranker is None:
+        return await adiscard_irrelevant_context(test_name, normal_ranges, retrieved_context, report, web_content, chat)
+    return await asyncio.to_thread(rerank_context, test_name, report, retrieved_context, web_content, reranker)
+
+
+async def agenerate_final_output(report, type, disease, generated_text, context, chat, normal_ranges=None):
+    prompt = final_output_prompt(report, type, disease, generated_text, context, normal_ranges)
+    return await ainvoke_text(chat, prompt)
+
+
+_STREAM_END = object()
+
+
+async def _read_stream(chain, prompt, queue):
+    """Read the whole model stream into ``queue`` under llm_semaphore.
+
+    The slot is released as soon as the model finishes, however slowly the
+    client reads; the buffer holds at most one answer's tokens.
+    """
+    try:
+        async with llm_semaphore:
+            async for token in chain.astream(prompt):
+                queue.put_nowait(token)
+    except Exception as e:
+        queue.put_nowait(e)
+    finally:
+        queue.put_nowait(_STREAM_END)
+
+
+async def astream_final_output(report, type, disease, generated_text, context, chat, normal_ranges=None):
+    """Yield the final interpretation as it is generated, with <think> blocks removed.
+
+    LangChain never consults the LLM cache for astream: streamed answers are
+    not served from or written to it (the response cache still stores the
+    finished result). In replay mode the answer therefore comes from one
+    cached ainvoke instead, so /chat/stream never reaches Groq.
+    """
+    prompt = final_output_prompt(report, type, disease, generated_text, context, normal_ranges)
+    if LLM_CACHE_MODE == "replay":
+        yield await ainvoke_text(chat, prompt)
+        return
+    queue = asyncio.Queue()
+    reader = asyncio.ensure_future(_read_stream(chat | StrOutputParser(), prompt, queue))
+    stripper = ThinkTagStripper()
+    try:
+        while True:
+            token = await queue.get()
+            if token is _STREAM_END:
+                break
+            if isinstance(token, Exception):
+                raise token
+            text = stripper.feed(token)
+            if text:
+                yield text
+    finally:
+        # A client that disconnects mid-answer stops the model call too.
+        reader.cancel()
+    text = stripper.flush()
+    if text:
+        yield text
+
+
+async def aweb_search(test_name, chat1, chat2, SERPER_API_KEY, tokenizer, max_tokens, chunk_gate=None):
+    try:
+        urls = await aget_URLs(test_name, SERPER_API_KEY)
+        interpretation = await aget_interpretations_list(test_name, urls, chat1, tokenizer, max_tokens, chunk_gate=chunk_gate)
+        text = await asummarize_web_content(interpretation, test_name, chat2, tokenizer)
+        logging.info("Web search completed")
+        return text
+    except Exception as e:
+        logging.error(f"Error during web search: {e}")
+        return ""
+
+
+async def aretrieve_context_batch(descriptions_per_item, embedding_model, index, top_k):
+    """Retrieve context for many reports: one encode call, concurrent index queries.
+
+    The encoder forward pass and the Pinecone client are both blocking, so
+    each runs in a worker thread.
+
+    Returns one list of query results per item, in the same order.
+    """
+    flat = [desc for descriptions in descriptions_per_item for desc in descriptions]
+    if not flat:
+        return [[] for _ in descriptions_per_item]
+    vectors = await asyncio.to_thread(encode_texts, flat, embedding_model)
+    results = await asyncio.gather(*(asyncio.to_thread(query_index, index, vector, top_k) for vector in vectors))
+    grouped = []
+    position = 0
+    for descriptions in descriptions_per_item:
+        grouped.append(list(results[position:position + len(descriptions)]))
+        position += len(descriptions)
+    return grouped
+
+
+async def adescribe_report(report, test_name, disease, chat, analysis=None):
+    """Retrieval descriptions from the local analyzer, or from the LLM for reports it cannot read.
+
+    ``analysis`` is the range-checked ReportAnalysis when the caller already has it.
+    """
+    if LOCAL_REPORT_ANALYSIS == "on":
+        if analysis is None:
+            analysis, _ = await asyncio.to_thread(analyze_report, report)
+        descriptions = await asyncio.to_thread(describe_report, report, test_name, disease, analysis)
+        if descriptions:
+            return descriptions
+    return await agenerate_refined_prompt(report, test_name, disease, chat)
+
+
+async def aVDB_search(test_name, report, chat2, disease, embedding_model, index, top_k=5, analysis=None):
+    try:
+        generated_text = await adescribe_report(report, test_name, disease, chat2, analysis)
+        retrieved_content = (await aretrieve_context_batch([generated_text], embedding_model, index, top_k))[0]
+        unique_content = select_context(retrieved_content)
+        logging.info("VDB search completed")
+        return unique_content, generated_text
+    except Exception as e:
+        logging.error(f"Error during VDB search: {e}")
+        return "", ""
+
+
+async def afinal_output(test_name, unique_content, report, text, disease, generated_text, chat1, chat2, normal_ranges, reranker=None):
+    try:
+        context = await afilter_context(test_name, normal_ranges, unique_content, report, text, chat1, reranker)
+        response = await agenerate_final_output(report, test_name, disease, generated_text, context, chat2, normal_ranges)
+        return response
+    except Exception as e:
+        logging.error(f"Error generating final output: {e}")
+        return ""
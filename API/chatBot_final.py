@@ -1,23 +1,28 @@
 import os
 import dotenv
 import logging
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+import json
 import tiktoken
-import concurrent.futures
+import asyncio
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 from typing import List, Dict
-import os
-from groq import Groq
-import dotenv
 from fastapi import FastAPI, UploadFile, File, HTTPException
-from starlette.responses import PlainTextResponse
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
 from pinecone import Pinecone
 from langchain_groq import ChatGroq
-from sentence_transformers import SentenceTransformer
-from functions import web_search, VDB_search, final_output, process_image
+from functions import process_image, report_token_stats
+from async_functions import aweb_search, aVDB_search, afinal_output, afilter_context, astream_final_output, close_http_client, SingleFlight, adescribe_report, aretrieve_context_batch
+from retrieval import select_context
+from rerank import create_reranker, create_chunk_gate
 from database import store_test_data, complete_retrival
+from response_cache import create_response_cache, cache_key
+from llm_cache import create_llm_cache
+from test_names import canonical_test_id
+from local_index import LocalIndex
+from embedding_service import create_encoder
+from model_routing import ModelRouter
+from reference_ranges import analyze_report, analyze_reports, normal_ranges_block
 
 
 # Configure logging
@@ -30,41 +35,84 @@ PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_API_KEY_2 = os.getenv("GROQ_API_KEY_2")
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
+# pinecone | local (see local_index.py)
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "pinecone")
 
-if not PINECONE_API_KEY or not GROQ_API_KEY or not SERPER_API_KEY:
+if (VECTOR_INDEX == "pinecone" and not PINECONE_API_KEY) or not GROQ_API_KEY or not SERPER_API_KEY:
     logging.error("API keys are not set in the environment variables.")
     raise EnvironmentError("API keys are not set in the environment variables.")
 
-model_name = "openai/gpt-oss-120b"
 index_name = "medical-data"
 vision_model = "meta-llama/llama-4-scout-17b-16e-instruct"
-# model_name = "llama-3.3-70b-versatile"
-# model_name = "qwen-2.5-32b"
 
-chat1 = ChatGroq(
-    api_key=GROQ_API_KEY,
-    model_name=model_name
-)
+# Shared by all clients; keys include the model configuration, so entries never cross models.
+llm_cache = create_llm_cache()
 
-vision_model = ChatGroq(api_key=GROQ_API_KEY, model_name=vision_model)
+vision_model = ChatGroq(api_key=GROQ_API_KEY, model_name=vision_model, cache=llm_cache)
 
-chat2 = ChatGroq(
-    api_key=GROQ_API_KEY_2,
-    model_name=model_name
-)
+# Small or large model per stage and report (see model_routing.py).
+router = ModelRouter([GROQ_API_KEY, GROQ_API_KEY_2], cache=llm_cache)
 tokenizer = tiktoken.get_encoding("cl100k_base")
 
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(index_name)
-embedding_model = SentenceTransformer("sentence-transformers/msmarco-bert-base-dot-v5")
+if VECTOR_INDEX == "local":
+    index = LocalIndex(
+        os.getenv("LOCAL_INDEX_PATH", "local_index"),
+        mode=os.getenv("LOCAL_INDEX_MODE", "exact"),
+        storage=os.getenv("LOCAL_INDEX_STORAGE", "float32"),
+        rescore=int(os.getenv("LOCAL_INDEX_RESCORE", "4")),
+    )
+else:
+    pc = Pinecone(api_key=PINECONE_API_KEY)
+    index = pc.Index(index_name)
+# Micro-batched in-process by default, or a shared worker (see embedding_service.py).
+embedding_model = create_encoder()
+# None keeps the LLM discard stage (CONTEXT_FILTER=llm, see rerank.py).
+reranker = create_reranker(embedding_model)
+# None sends every web chunk to the extraction LLM (CHUNK_GATE=off).
+chunk_gate = create_chunk_gate(embedding_model)
+response_cache = create_response_cache()
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "100"))
+
+web_search_flights = SingleFlight()
+
+async def lookup_web_summary(test_name):
+    _, web_description = await asyncio.to_thread(complete_retrival, test_name)
+    return web_description
+
+async def search_web_summary(test_name):
+    """Run the web search for an uncached test at most once per canonical test at a time."""
+    async def search_and_store():
+        web_results = await aweb_search(test_name, router.client("extract"), router.client("summarize"), SERPER_API_KEY, tokenizer, max_tokens=4500, chunk_gate=chunk_gate)
+        if web_results:
+            try:
+                await asyncio.to_thread(store_test_data, test_name, web_results)
+            except Exception as e:
+                logging.error(f"Error storing web summary for {test_name}: {e}")
+        return web_results
+
+    canonical_id = canonical_test_id(test_name)
+    if canonical_id in web_search_flights:
+        logging.info(f"Joining in-flight web search for {canonical_id}")
+    return await web_search_flights.do(canonical_id, search_and_store)
+
+def report_cache_key(request):
+    return cache_key(canonical_test_id(request.test_name), request.report, request.disease, router.signature())
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await close_http_client()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 class ReportRequest(BaseModel):
     test_name: str
     report: str
     disease: str
 
+class BatchReportRequest(BaseModel):
+    reports: List[ReportRequest]
+
 class LabReport(BaseModel):
     test_name: str = Field(description="The name of the medical lab test (e.g., Complete Blood Count, Lipid Profile)")
     table_data: List[Dict[str, str]] = Field(description="List of dictionaries containing the lab report data.")
@@ -81,7 +129,7 @@ async def extract_lab_report(file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="No image data provided")
 
         # Process the image (returns a LabReport object)
-        lab_report = process_image(vision_model, image_content, LabReport)
+        lab_report = await asyncio.to_thread(process_image, vision_model, image_content, LabReport)
 
         if not lab_report:
             raise HTTPException(status_code=500, detail="Failed to extract lab report data")
@@ -97,39 +145,207 @@ async def extract_lab_report(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 @app.post("/chat")
-def process_report(request: ReportRequest):
+async def process_report(request: ReportRequest):
     try:
-        flag = False
         logging.info(f"Received request: {request.model_dump_json()}")
         test_name = request.test_name
         report = request.report
         disease = request.disease
-        name_of_test, web_description = complete_retrival(test_name)
+        key = report_cache_key(request)
+        cached = await response_cache.aget(key)
+        if cached is not None:
+            logging.info("Response cache hit")
+            return {"result": cached}
+
+        web_description = await lookup_web_summary(test_name)
         logging.info(f"web_description: {web_description}")
-        if web_description is not None:
-            web_search_content = web_description
-            flag = True
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            if not flag:
-                web_search_content = executor.submit(web_search, test_name, chat1, chat2, SERPER_API_KEY, tokenizer, max_tokens=4500)
-            VDB_content = executor.submit(VDB_search, test_name, report, chat2, disease, embedding_model, index, top_k=5)
-            
-            try:
-                web_results = web_search_content.result() if not flag else web_search_content
-                vector_results, generated_text = VDB_content.result()
-            except Exception as e:
-                logging.error(f"An error occurred: {e}")
-                raise HTTPException(status_code=500, detail="Internal Server Error")
-            
-            final_results = final_output(test_name, vector_results, report, web_results, disease, generated_text, chat1, chat2, normal_ranges=None)
-            if not flag:
-                store_test_data(test_name, web_results)
-            return {"result": final_results}
+        flag = web_description is not None
+
+        analysis, checks = await asyncio.to_thread(analyze_report, report)
+        normal_ranges = normal_ranges_block(checks)
+        vdb_task = aVDB_search(test_name, report, router.client("refined", analysis), disease, embedding_model, index, top_k=5, analysis=analysis)
+        try:
+            if flag:
+                web_results = web_description
+                vector_results, generated_text = await vdb_task
+            else:
+                web_results, (vector_results, generated_text) = await asyncio.gather(search_web_summary(test_name), vdb_task)
+        except Exception as e:
+            logging.error(f"An error occurred: {e}")
+            raise HTTPException(status_code=500, detail="Internal Server Error")
+
+        final_results = await afinal_output(
+            test_name, vector_results, report, web_results, disease, generated_text,
+            router.client("discard", analysis), router.client("final", analysis), normal_ranges=normal_ranges, reranker=reranker,
+        )
+        if final_results:
+            await response_cache.aset(key, final_results)
+        return {"result": final_results}
     except Exception as e:
         logging.error(f"Error processing report: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_report_events(request: ReportRequest):
+    test_name = request.test_name
+    report = request.report
+    disease = request.disease
+    tasks = {}
+    try:
+        key = report_cache_key(request)
+        cached = await response_cache.aget(key)
+        yield sse_event("stage", {"stage": "response_cache", "status": "hit" if cached is not None else "miss"})
+        if cached is not None:
+            yield sse_event("done", {"result": cached})
+            return
+
+        web_description = await lookup_web_summary(test_name)
+        flag = web_description is not None
+        yield sse_event("stage", {"stage": "summary_cache", "status": "hit" if flag else "miss"})
+
+        analysis, checks = await asyncio.to_thread(analyze_report, report)
+        normal_ranges = normal_ranges_block(checks)
+        vdb_task = asyncio.create_task(aVDB_search(test_name, report, router.client("refined", analysis), disease, embedding_model, index, top_k=5, analysis=analysis))
+        tasks[vdb_task] = "vdb_search"
+        if not flag:
+            web_task = asyncio.create_task(search_web_summary(test_name))
+            tasks[web_task] = "web_search"
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield sse_event("stage", {"stage": tasks[task], "status": "done"})
+
+        web_results = web_description if flag else web_task.result()
+        vector_results, generated_text = vdb_task.result()
+
+        context = await afilter_context(test_name, normal_ranges, vector_results, report, web_results, router.client("discard", analysis), reranker)
+        yield sse_event("stage", {"stage": "context_filtered", "status": "done"})
+
+        result = []
+        async for text in astream_final_output(report, test_name, disease, generated_text, context, router.client("final", analysis), normal_ranges):
+            result.append(text)
+            yield sse_event("token", {"text": text})
+        final_results = "".join(result)
+        if final_results:
+            await response_cache.aset(key, final_results)
+        yield sse_event("done", {"result": final_results})
+    except Exception as e:
+        logging.error(f"Error streaming report: {e}")
+        yield sse_event("error", {"detail": "Internal Server Error"})
+    finally:
+        # Client disconnects close the generator early; don't leave stages running.
+        for task in tasks:
+            task.cancel()
+
+async def batch_result_lines(requests):
+    """Yield one NDJSON line per report, in completion order."""
+    def line(i, result=None, error=None):
+        item = {"index": i, "test_name": requests[i].test_name}
+        if error is None:
+            item["result"] = result
+        else:
+            item["error"] = error
+        return json.dumps(item) + "\n"
+
+    keys = [report_cache_key(request) for request in requests]
+    pending = []
+    for i, key in enumerate(keys):
+        cached = await response_cache.aget(key)
+        if cached is not None:
+            yield line(i, cached)
+        else:
+            pending.append(i)
+    if not pending:
+        return
+
+    async def web_summary(test_name):
+        summary = await lookup_web_summary(test_name)
+        return summary if summary is not None else await search_web_summary(test_name)
+
+    # One summary lookup (and at most one web search) per distinct test in the batch.
+    web_tasks = {}
+    for i in pending:
+        canonical_id = canonical_test_id(requests[i].test_name)
+        if canonical_id not in web_tasks:
+            web_tasks[canonical_id] = asyncio.create_task(web_summary(requests[i].test_name))
+
+    async def finish(i, generated_text, retrieved_content, analysis, checks):
+        request = requests[i]
+        try:
+            web_results = await web_tasks[canonical_test_id(request.test_name)]
+            unique_content = select_context(retrieved_content, tokenizer)
+            result = await afinal_output(
+                request.test_name, unique_content, request.report, web_results, request.disease, generated_text,
+                router.client("discard", analysis), router.client("final", analysis), normal_ranges=normal_ranges_block(checks), reranker=reranker,
+            )
+            if result:
+                await response_cache.aset(keys[i], result)
+            return i, result, None
+        except Exception as e:
+            logging.error(f"Error processing batch item {i}: {e}")
+            return i, None, "Internal Server Error"
+
+    finish_tasks = []
+    try:
+        # One vectorized range check for every report in the batch.
+        analyzed = await asyncio.to_thread(analyze_reports, [requests[i].report for i in pending])
+        descriptions = await asyncio.gather(*(
+            adescribe_report(requests[i].report, requests[i].test_name, requests[i].disease, router.client("refined", analysis), analysis)
+            for i, (analysis, _) in zip(pending, analyzed)
+        ), return_exceptions=True)
+        descriptions = [[] if isinstance(d, Exception) else d for d in descriptions]
+        try:
+            retrieved = await aretrieve_context_batch(descriptions, embedding_model, index, top_k=5)
+        except Exception as e:
+            logging.error(f"Error during batch VDB search: {e}")
+            retrieved = [[] for _ in pending]
+
+        finish_tasks = [
+            asyncio.create_task(finish(i, d, r, analysis, checks))
+            for i, d, r, (analysis, checks) in zip(pending, descriptions, retrieved, analyzed)
+        ]
+        for next_done in asyncio.as_completed(finish_tasks):
+            i, result, error = await next_done
+            yield line(i, result, error)
+    finally:
+        for task in finish_tasks + list(web_tasks.values()):
+            task.cancel()
+
+@app.post("/chat/batch")
+async def process_report_batch(batch: BatchReportRequest):
+    if not batch.reports:
+        raise HTTPException(status_code=400, detail="No reports provided")
+    if len(batch.reports) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} reports per batch")
+    logging.info(f"Received batch of {len(batch.reports)} reports")
+    return StreamingResponse(batch_result_lines(batch.reports), media_type="application/x-ndjson")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    stats = {"responses": await response_cache.astats()}
+    if llm_cache is not None:
+        stats["llm"] = await asyncio.to_thread(llm_cache.stats)
+    if hasattr(embedding_model, "stats"):
+        stats["embedding_batches"] = embedding_model.stats()
+    if chunk_gate is not None:
+        stats["chunk_gate"] = chunk_gate.stats()
+    stats["report_tokens"] = report_token_stats.stats()
+    stats["model_routes"] = router.stats()
+    return stats
+
+@app.post("/chat/stream")
+async def process_report_stream(request: ReportRequest):
+    logging.info(f"Received streaming request: {request.model_dump_json()}")
+    return StreamingResponse(
+        stream_report_events(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
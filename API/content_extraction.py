@@ -0,0 +1,208 @@
+"""Main-content extraction for scraped pages.
+
+clean_text used to hand the whole page text (navigation, cookie banners,
+footers, related-article lists) to chunk_text, and every chunk of it became
+a paid extraction call. extract_main_text keeps only the article:
+
+1. site rules for the sources we know (the same selections the scrapers in
+   Scrapper/ use for testing.com and medlineplus.gov);
+2. otherwise, drop boilerplate elements by tag and by id/class, score
+   containers by the paragraph text they hold (text density), take the best
+   one and drop link-heavy blocks inside it;
+3. fall back to the whole de-boilerplated body when that leaves too little,
+   and to the plain page text when even that is empty.
+
+Class names are only a hint: wrappers such as "site-content right-sidebar"
+or "content no-ads" match the boilerplate pattern, so elements holding an
+article, main or most of the page's paragraph text are never dropped.
+
+The result keeps one blank line between block elements, so later stages
+(near_dup.py) can work paragraph by paragraph.
+
+lxml is used as the parser when installed; html.parser otherwise.
+"""
+import logging
+import re
+from urllib.parse import urlparse
+from bs4 import BeautifulSoup
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "nav", "header", "footer", "aside", "form", "iframe", "svg", "button", "select"]
+BOILERPLATE_CLASS = re.compile(
+    r"(^|[-_])(nav|navbar|menu|breadcrumbs?|cookies?|consent|banner|footer|header|sidebar|related|share|social|"
+    r"newsletter|subscribe|advert|ads?|promo|popup|modal|comments?|skip)([-_]|$)",
+    re.I,
+)
+BLOCK_TAGS = ["p", "li", "h1", "h2", "h3", "h4", "h5", "h6", "td", "th", "dt", "dd", "blockquote", "pre", "div", "section", "article", "tr", "br"]
+PARAGRAPH_MARK = "\u2029"
+# Blocks whose text is mostly link text are menus or "related articles" lists.
+MAX_LINK_DENSITY = 0.5
+# Below this many characters the density pick probably missed the article.
+MIN_CONTENT_CHARS = 500
+# An element holding at least this share of the page's paragraph text is content, whatever its class says.
+MAX_BOILERPLATE_TEXT_SHARE = 0.5
+
+# Sections of testing.com pages that are shopping widgets or reference lists (see testingLab_scrapper.py).
+TESTING_COM_SKIP_SECTIONS = {
+    "sec-_resources-section",
+    "sec-_related_tests-section",
+    "sec-_sources-section",
+    "sec-_the_best_at_home_chlamydia_tests_compared-section",
+    "sec-_the_best_at_home_herpes_tests_compared-section",
+    "sec-_benefits_and_downsides_of_the_at_home_stress_and_sleep_test-section",
+    "sec-_types_of_at_home_tests-section",
+    "sec-_benefits_and_downsides_of_at_home_thyroid_testing-section",
+    "_benefits_and_downsides_of_at_home_vitamin_d_test",
+    "sec-_the_best_at_home_covid_19_pcr_tests_compared-section",
+    "sec-_benefits_and_downsides_of_at_home_covid_19_pcr_tests-section",
+    "sec-_the_best_at_home_covid_19_pcr_tests-section",
+}
+TESTING_COM_SKIP_CLASSES = ["test-kit-wrap", "kit-body", "row-wrap"]
+
+
+def normalize_whitespace(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def paragraph_text(elements):
+    """Text of the elements, one paragraph per block element, separated by blank lines."""
+    for element in elements:
+        for block in element.find_all(BLOCK_TAGS):
+            block.insert_before(PARAGRAPH_MARK)
+            block.insert_after(PARAGRAPH_MARK)
+    text = PARAGRAPH_MARK.join(element.get_text(" ") for element in elements)
+    paragraphs = (normalize_whitespace(paragraph) for paragraph in text.split(PARAGRAPH_MARK))
+    return "\n\n".join(paragraph for paragraph in paragraphs if paragraph)
+
+
+def testing_com_sections(soup):
+    content = soup.find("div", class_="content")
+    if content is None:
+        return None
+    return [
+        section for section in content.find_all("section")
+        if section.get("id", "") not in TESTING_COM_SKIP_SECTIONS
+        and not section.find("div", class_=TESTING_COM_SKIP_CLASSES)
+    ]
+
+
+def medlineplus_sections(soup):
+    main = soup.find("div", class_="main")
+    if main is None:
+        return None
+    # The last section is the references list.
+    return main.find_all("section")[:-1]
+
+
+SITE_RULES = {
+    "testing.com": testing_com_sections,
+    "medlineplus.gov": medlineplus_sections,
+}
+
+
+def site_rule(url):
+    if not url:
+        return None
+    host = urlparse(url).netloc.lower()
+    for domain, rule in SITE_RULES.items():
+        if host == domain or host.endswith("." + domain):
+            return rule
+    return None
+
+
+def is_boilerplate(element):
+    if element.attrs is None:
+        return False
+    names = [element.get("id") or ""] + list(element.get("class") or [])
+    if element.get("role") in ("navigation", "banner", "contentinfo", "dialog"):
+        return True
+    return any(BOILERPLATE_CLASS.search(name) for name in names if name)
+
+
+def paragraph_length(element):
+    return sum(len(p.get_text(strip=True)) for p in element.find_all("p"))
+
+
+def holds_content(element, page_paragraph_length):
+    if element.name in ("article", "main") or element.find(["article", "main"]) is not None:
+        return True
+    return page_paragraph_length > 0 and paragraph_length(element) >= MAX_BOILERPLATE_TEXT_SHARE * page_paragraph_length
+
+
+def strip_boilerplate(root):
+    for element in root.find_all(BOILERPLATE_TAGS):
+        element.decompose()
+    page_paragraph_length = paragraph_length(root)
+    # Collect first: decomposing while iterating find_all skips elements.
+    for element in [e for e in root.find_all(True) if is_boilerplate(e)]:
+        if not element.decomposed and not holds_content(element, page_paragraph_length):
+            element.decompose()
+
+
+def link_density(element, text_length):
+    link_length = sum(len(a.get_text(strip=True)) for a in element.find_all("a"))
+    return link_length / max(text_length, 1)
+
+
+def densest_container(root):
+    """Readability-style pick: each paragraph credits its parent fully and its grandparent by half."""
+    scores = {}
+    for paragraph in root.find_all(["p", "li", "td"]):
+        length = len(paragraph.get_text(strip=True))
+        if length < 25:
+            continue
+        parent = paragraph.parent
+        if parent is None:
+            continue
+        scores[parent] = scores.get(parent, 0) + length
+        if parent.parent is not None:
+            scores[parent.parent] = scores.get(parent.parent, 0) + length / 2
+    if not scores:
+        return None
+    return max(scores, key=scores.get)
+
+
+def drop_link_lists(container):
+    for block in [e for e in container.find_all(["ul", "ol", "div", "section", "table"])]:
+        if block.decomposed:
+            continue
+        text_length = len(block.get_text(strip=True))
+        if text_length and link_density(block, text_length) > MAX_LINK_DENSITY:
+            block.decompose()
+
+
+def extract_main_text(html, url=None):
+    """Return the main article text of a page, paragraphs separated by blank lines."""
+    if not html:
+        return ""
+    soup = BeautifulSoup(html, PARSER)
+    rule = site_rule(url)
+    if rule is not None:
+        sections = rule(soup)
+        if sections:
+            text = paragraph_text(sections)
+            if text:
+                return text
+        logging.info(f"Site rule found no content on {url}; using the generic extractor")
+
+    body = soup.body or soup
+    strip_boilerplate(body)
+    container = body.find("article") or body.find("main") or body.find(attrs={"role": "main"}) or densest_container(body)
+    if container is not None:
+        drop_link_lists(container)
+        text = paragraph_text([container])
+        if len(text) >= MIN_CONTENT_CHARS:
+            return text
+    fallback = paragraph_text([body])
+    text = fallback if container is None or len(fallback) > len(text) else text
+    if not text:
+        # Everything was stripped; the unfiltered page text beats nothing.
+        return normalize_whitespace(BeautifulSoup(html, PARSER).get_text(" "))
+    return text
@@ -1,10 +1,11 @@
-from appwrite.client import Client
-from appwrite.services.databases import Databases
-from appwrite.id import ID
 import os
-import json
-from appwrite.query import Query
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 import dotenv
+from test_names import normalize_test_name, canonical_test_id
 
 
 dotenv.load_dotenv('.env')
@@ -19,31 +20,175 @@ END_POINT = os.getenv('END_POINT')
 # SCORES_ID = os.getenv('SCORES_ID')
 WEB_SEARCH_DATA_ID = os.getenv('WEB_SEARCH_DATA_ID')
 
-client = Client()
-client.set_endpoint(END_POINT)
-client.set_project(PROJECT_ID)
-client.set_key(APPWRITE_API)  # Use a server-side key
+# appwrite | sqlite
+WEB_SEARCH_STORE = os.getenv('WEB_SEARCH_STORE', 'appwrite')
+WEB_SEARCH_SQLITE_PATH = os.getenv('WEB_SEARCH_SQLITE_PATH', 'web_search_data.sqlite3')
+WEB_SEARCH_LRU_SIZE = int(os.getenv('WEB_SEARCH_LRU_SIZE', '1024'))
 
-database = Databases(client)
 
+class AppwriteBackend:
+    def __init__(self):
+        from appwrite.client import Client
+        from appwrite.services.databases import Databases
+
+        client = Client()
+        client.set_endpoint(END_POINT)
+        client.set_project(PROJECT_ID)
+        client.set_key(APPWRITE_API)  # Use a server-side key
+        self.database = Databases(client)
+
+    @staticmethod
+    def document_id(test_name):
+        # Deterministic, so storing the same test twice updates one document.
+        return hashlib.sha256(normalize_test_name(test_name).encode("utf-8")).hexdigest()[:32]
+
+    def get(self, test_name):
+        from appwrite.exception import AppwriteException
+        from appwrite.query import Query
+
+        try:
+            return self.database.get_document(
+                database_id=DATABASE_ID,
+                collection_id=WEB_SEARCH_DATA_ID,
+                document_id=self.document_id(test_name)
+            )
+        except AppwriteException as e:
+            if e.code != 404:
+                raise
+        # Documents created before deterministic IDs are only reachable by query.
+        names = list(dict.fromkeys([test_name, normalize_test_name(test_name)]))
+        response = self.database.list_documents(
+            database_id=DATABASE_ID,
+            collection_id=WEB_SEARCH_DATA_ID,
+            queries=[Query.equal("test_name", names)]
+        )
+        documents = response.get("documents") or []
+        return documents[0] if documents else None
+
+    def put(self, test_name, web_summarized_data):
+        """Idempotent upsert keyed by document_id(test_name)."""
+        from appwrite.exception import AppwriteException
+
+        data = {"test_name": test_name, "web_summarized_data": web_summarized_data}
+        document_id = self.document_id(test_name)
+        try:
+            return self.database.create_document(
+                database_id=DATABASE_ID,
+                collection_id=WEB_SEARCH_DATA_ID,
+                document_id=document_id,
+                data=data
+            )
+        except AppwriteException as e:
+            if e.code != 409:
+                raise
+        return self.database.update_document(
+            database_id=DATABASE_ID,
+            collection_id=WEB_SEARCH_DATA_ID,
+            document_id=document_id,
+            data=data
+        )
+
+
+class SQLiteBackend:
+    """Local replacement for the Appwrite collection (self-hosted / offline runs)."""
+
+    def __init__(self, path=WEB_SEARCH_SQLITE_PATH):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS web_search_data (
+                normalized_name TEXT PRIMARY KEY,
+                test_name TEXT NOT NULL,
+                web_summarized_data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self.connection.commit()
+
+    def get(self, test_name):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT test_name, web_summarized_data FROM web_search_data WHERE normalized_name = ?",
+                (normalize_test_name(test_name),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"test_name": row[0], "web_summarized_data": row[1]}
+
+    def put(self, test_name, web_summarized_data):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO web_search_data VALUES (?, ?, ?, ?)",
+                (normalize_test_name(test_name), test_name, web_summarized_data, time.time())
+            )
+            self.connection.commit()
+        return {"test_name": test_name, "web_summarized_data": web_summarized_data}
+
+
+class TieredStore:
+    """In-process LRU in front of a persistent backend.
+
+    Misses are not cached, so a summary stored by another worker becomes
+    visible on the next lookup.
+    """
+
+    def __init__(self, backend, max_entries=WEB_SEARCH_LRU_SIZE):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, test_name):
+        key = normalize_test_name(test_name)
+        with self.lock:
+            document = self.entries.get(key)
+            if document is not None:
+                self.entries.move_to_end(key)
+                return document
+        document = self.backend.get(test_name)
+        if document is not None:
+            self._remember(key, document)
+        return document
+
+    def put(self, test_name, web_summarized_data):
+        response = self.backend.put(test_name, web_summarized_data)
+        self._remember(normalize_test_name(test_name), {"test_name": test_name, "web_summarized_data": web_summarized_data})
+        return response
+
+    def _remember(self, key, document):
+        with self.lock:
+            self.entries[key] = document
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def create_store(kind=WEB_SEARCH_STORE):
+    if kind == "sqlite":
+        backend = SQLiteBackend()
+    elif kind == "appwrite":
+        backend = AppwriteBackend()
+    else:
+        raise ValueError(f"Unknown WEB_SEARCH_STORE '{kind}', expected 'appwrite' or 'sqlite'")
+    return TieredStore(backend)
+
+
+store = create_store()
 
 
 def store_test_data(test_name, web_summarized_data):
-    response = database.create_document(
-        database_id = DATABASE_ID,
-        collection_id = WEB_SEARCH_DATA_ID,
-        document_id=ID.unique(),
-        data={"test_name": test_name, "web_summarized_data": web_summarized_data}
-    )
-    return response
+    # Stored under the canonical ID so every alias of the test finds it.
+    return store.put(canonical_test_id(test_name), web_summarized_data)
 
 def retrieve_test_data(test_name):
-    response = database.list_documents(
-        database_id=DATABASE_ID,
-        collection_id=WEB_SEARCH_DATA_ID,
-        queries=[Query.equal("test_name", test_name)]
-    )
-    return response
+    canonical_id = canonical_test_id(test_name)
+    document = store.get(canonical_id)
+    if document is None and normalize_test_name(test_name) != canonical_id:
+        # Documents written before canonicalization are keyed by the raw name.
+        document = store.get(test_name)
+    # Same shape as Appwrite's list_documents response so parse_data is backend agnostic.
+    return {"documents": [document] if document is not None else []}
 
 
 # data = retrieve_test_data("CBC")
@@ -0,0 +1,192 @@
+"""Selectable CPU inference backends for the query encoder.
+
+``torch`` is the stock SentenceTransformer. ``onnx`` runs an exported ONNX
+graph of the same transformer under onnxruntime, and ``onnx-int8`` runs a
+dynamically int8-quantized copy of that graph. All three expose the
+``encode(sentences, ...)`` call that aretrieve_context_batch uses, so the API
+picks one with EMBEDDING_BACKEND and nothing else changes.
+
+Export once, offline (needs torch), then check the graphs against the
+PyTorch model. The API never exports: an onnx backend without its exported
+files fails at startup.
+
+    python embedding_backends.py export --out onnx_encoder
+    python embedding_backends.py parity --out onnx_encoder
+"""
+import argparse
+import json
+import logging
+import os
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/msmarco-bert-base-dot-v5"
+# torch | onnx | onnx-int8
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx_encoder")
+
+ONNX_FILES = {"onnx": "model.onnx", "onnx-int8": "model_int8.onnx"}
+CONFIG_FILE = "encoder_config.json"
+
+PARITY_TEXTS = [
+    "Low hemoglobin and low mean corpuscular volume suggest iron deficiency anemia.",
+    "The white blood cell count is elevated, which may indicate an infection.",
+    "Elevated TSH with a low free T4 is consistent with primary hypothyroidism.",
+    "LDL cholesterol is above the desirable range and HDL is low.",
+    "Creatinine and blood urea nitrogen are raised, suggesting reduced kidney function.",
+    "Platelet count is within the normal reference range.",
+]
+
+
+def export_onnx(out_dir=ONNX_MODEL_DIR, model_name=EMBEDDING_MODEL_NAME, quantize=True):
+    """Export the transformer of the SentenceTransformer to ONNX (and an int8 copy)."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(out_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer, pooling = model[0], model[1]
+    hf_model = transformer.auto_model.eval()
+    transformer.tokenizer.save_pretrained(out_dir)
+
+    dummy = transformer.tokenizer(["export"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    path = os.path.join(out_dir, ONNX_FILES["onnx"])
+    with torch.no_grad():
+        torch.onnx.export(
+            hf_model,
+            tuple(dummy[name] for name in input_names),
+            path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    with open(os.path.join(out_dir, CONFIG_FILE), "w") as f:
+        json.dump({
+            "model_name": model_name,
+            "pooling": pooling.get_pooling_mode_str(),
+            "max_seq_length": model.max_seq_length,
+            "input_names": input_names,
+        }, f)
+    logging.info(f"Exported {model_name} to {path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(out_dir, ONNX_FILES["onnx-int8"])
+        quantize_dynamic(path, int8_path, weight_type=QuantType.QInt8)
+        logging.info(f"Wrote dynamically quantized model to {int8_path}")
+
+
+class OnnxEncoder:
+    """Minimal SentenceTransformer.encode replacement on top of onnxruntime."""
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, backend="onnx", intra_op_threads=0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, ONNX_FILES[backend]), options, providers=["CPUExecutionProvider"]
+        )
+        self.backend = backend
+
+    def _pool(self, hidden, attention_mask):
+        if self.config["pooling"] == "cls":
+            return hidden[:, 0]
+        mask = attention_mask[..., None].astype(hidden.dtype)
+        summed = (hidden * mask).sum(axis=1)
+        if self.config["pooling"] == "mean":
+            return summed / np.maximum(mask.sum(axis=1), 1e-9)
+        raise ValueError(f"Unsupported pooling mode '{self.config['pooling']}'")
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        embeddings = []
+        for start in range(0, len(sentences), batch_size):
+            batch = self.tokenizer(
+                list(sentences[start:start + batch_size]),
+                padding=True,
+                truncation=True,
+                max_length=self.config["max_seq_length"],
+                return_tensors="np",
+            )
+            inputs = {name: batch[name].astype(np.int64) for name in self.config["input_names"]}
+            hidden = self.session.run(["last_hidden_state"], inputs)[0]
+            embeddings.append(self._pool(hidden, batch["attention_mask"]))
+        embeddings = np.concatenate(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+        if normalize_embeddings:
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        embeddings = embeddings.astype(np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def load_embedding_model(backend=EMBEDDING_BACKEND, model_dir=ONNX_MODEL_DIR):
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+    if backend not in ONNX_FILES:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}', expected torch, onnx or onnx-int8")
+    # Exporting needs torch, which the onnx backends exist to keep out of the API process.
+    missing = [name for name in (ONNX_FILES[backend], CONFIG_FILE) if not os.path.exists(os.path.join(model_dir, name))]
+    if missing:
+        raise FileNotFoundError(
+            f"EMBEDDING_BACKEND={backend} needs {', '.join(missing)} in {model_dir}; "
+            f"export it first with: python embedding_backends.py export --out {model_dir}"
+        )
+    return OnnxEncoder(model_dir, backend=backend)
+
+
+def check_parity(reference, candidate, texts=PARITY_TEXTS):
+    """Compare two encoders on the same texts.
+
+    Returns the minimum cosine similarity between paired embeddings, the
+    largest absolute element difference, and whether every text keeps the
+    same nearest neighbour among the others.
+    """
+    expected = np.asarray(reference.encode(texts), dtype=np.float32)
+    actual = np.asarray(candidate.encode(texts), dtype=np.float32)
+    expected_unit = expected / np.linalg.norm(expected, axis=1, keepdims=True)
+    actual_unit = actual / np.linalg.norm(actual, axis=1, keepdims=True)
+    cosine = (expected_unit * actual_unit).sum(axis=1)
+    # Column 0 of each argsort row is the text itself.
+    expected_neighbours = np.argsort(-(expected_unit @ expected_unit.T), axis=1)[:, 1]
+    actual_neighbours = np.argsort(-(actual_unit @ actual_unit.T), axis=1)[:, 1]
+    return {
+        "min_cosine": float(cosine.min()),
+        "max_abs_diff": float(np.abs(expected - actual).max()),
+        "same_neighbours": bool((expected_neighbours == actual_neighbours).all()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and verify ONNX backends for the query encoder.")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--out", default=ONNX_MODEL_DIR)
+    parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+    if args.command == "export":
+        export_onnx(args.out, quantize=not args.no_quantize)
+        return
+    reference = load_embedding_model("torch")
+    for backend in ONNX_FILES:
+        if os.path.exists(os.path.join(args.out, ONNX_FILES[backend])):
+            print(backend, check_parity(reference, OnnxEncoder(args.out, backend=backend)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Dynamic micro-batching for the query encoder.
+
+Concurrent /chat requests each need one or two short descriptions encoded.
+Run one at a time, that is many batch-of-one BERT passes fighting over the
+same cores. MicroBatchEncoder queues those calls, waits up to a few
+milliseconds for more to arrive, encodes everything as one batch and hands
+each caller back its own rows.
+
+It can run in-process (wrap the model) or as a separate worker that every
+API worker shares, so only one copy of the model is resident:
+
+    python embedding_service.py            # serves POST /encode on :8002
+    EMBEDDING_SERVICE=remote EMBEDDING_SERVICE_URL=http://localhost:8002 python chatBot_final.py
+"""
+import base64
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import List
+import httpx
+import numpy as np
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "3"))
+# inprocess | remote | off
+EMBEDDING_SERVICE = os.getenv("EMBEDDING_SERVICE", "inprocess")
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "http://localhost:8002")
+EMBEDDING_SERVICE_PORT = int(os.getenv("EMBEDDING_SERVICE_PORT", "8002"))
+
+
+class MicroBatchEncoder:
+    """Thread-safe ``encode()`` that coalesces concurrent calls into batches.
+
+    A batch is flushed once it holds ``max_batch`` texts or ``max_wait_ms``
+    has passed since its first request, whichever comes first.
+    """
+
+    def __init__(self, model, max_batch=EMBEDDING_BATCH_SIZE, max_wait_ms=EMBEDDING_BATCH_WAIT_MS):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        self.worker = threading.Thread(target=self._run, name="embedding-microbatch", daemon=True)
+        self.worker.start()
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        future = concurrent.futures.Future()
+        self.requests.put((texts, future))
+        embeddings = future.result()
+        return embeddings[0] if single else embeddings
+
+    def _collect(self):
+        pending = [self.requests.get()]
+        size = len(pending[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(item)
+            size += len(item[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            texts = [text for item_texts, _ in pending for text in item_texts]
+            try:
+                embeddings = np.asarray(self.model.encode(texts), dtype=np.float32)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            position = 0
+            for item_texts, future in pending:
+                future.set_result(embeddings[position:position + len(item_texts)])
+                position += len(item_texts)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+        }
+
+
+def encode_array(array):
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"data": base64.b64encode(array.tobytes()).decode("ascii"), "shape": list(array.shape)}
+
+
+def decode_array(payload):
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(payload["shape"])
+
+
+class RemoteEncoder:
+    """``encode()`` client for the shared embedding worker."""
+
+    def __init__(self, url=EMBEDDING_SERVICE_URL, timeout=30.0):
+        self.url = url.rstrip("/")
+        self.client = httpx.Client(timeout=timeout)
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        response = self.client.post(f"{self.url}/encode", json={"texts": texts})
+        response.raise_for_status()
+        embeddings = decode_array(response.json())
+        return embeddings[0] if single else embeddings
+
+
+def create_encoder(service=EMBEDDING_SERVICE):
+    """Return the encoder the API should use, according to EMBEDDING_SERVICE."""
+    if service == "remote":
+        logging.info(f"Encoding queries with the embedding service at {EMBEDDING_SERVICE_URL}")
+        return RemoteEncoder(EMBEDDING_SERVICE_URL)
+    from embedding_backends import load_embedding_model
+
+    if service == "off":
+        return load_embedding_model()
+    if service != "inprocess":
+        raise ValueError(f"Unknown EMBEDDING_SERVICE '{service}', expected inprocess, remote or off")
+    return MicroBatchEncoder(load_embedding_model())
+
+
+class EncodeRequest(BaseModel):
+    texts: List[str]
+
+
+def create_app():
+    state = {}
+
+    @asynccontextmanager
+    async def lifespan(app):
+        from embedding_backends import load_embedding_model
+
+        state["encoder"] = MicroBatchEncoder(load_embedding_model())
+        yield
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post("/encode")
+    def encode(request: EncodeRequest):
+        # Sync endpoint: runs in the threadpool and blocks on its batch, which is the point.
+        return encode_array(state["encoder"].encode(request.texts))
+
+    @app.get("/stats")
+    def stats():
+        return state["encoder"].stats()
+
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=EMBEDDING_SERVICE_PORT)
@@ -3,11 +3,22 @@ import requests
 import base64
 from langchain_core.output_parsers import PydanticOutputParser
 import json
+import os
+import bisect
+import functools
+import itertools
+import hashlib
+import threading
+from collections import OrderedDict
 import re
 import logging
-from bs4 import BeautifulSoup
 from langchain_core.output_parsers import StrOutputParser
 from langchain.schema import SystemMessage, HumanMessage
+from retrieval import default_tokenizer, uses_match_vectors
+from content_extraction import extract_main_text
+from near_dup import dedupe_documents
+from lab_analysis import compact_report
+from reference_ranges import analyze_report
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -17,45 +28,156 @@ def remove_tags(text):
     cleaned_text = re.sub(pattern, '', text)
     return cleaned_text
 
+class ThinkTagStripper:
+    """Incremental version of remove_tags for streamed model output.
+
+    feed() returns the text that is safe to emit so far; anything that could
+    still turn out to be part of a <think> tag is held back until the next
+    token (or flush()) settles it.
+    """
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.inside = False
+
+    def feed(self, text):
+        self.buffer += text
+        output = []
+        while self.buffer:
+            tag = self.CLOSE if self.inside else self.OPEN
+            position = self.buffer.find(tag)
+            if position != -1:
+                if not self.inside:
+                    output.append(self.buffer[:position])
+                self.buffer = self.buffer[position + len(tag):]
+                self.inside = not self.inside
+                continue
+            # Keep the longest suffix that is a prefix of the tag we are waiting for.
+            keep = 0
+            for size in range(min(len(tag) - 1, len(self.buffer)), 0, -1):
+                if tag.startswith(self.buffer[-size:]):
+                    keep = size
+                    break
+            if not self.inside:
+                output.append(self.buffer[:len(self.buffer) - keep])
+            self.buffer = self.buffer[len(self.buffer) - keep:]
+            break
+        return "".join(output)
+
+    def flush(self):
+        remaining = "" if self.inside else self.buffer
+        self.buffer = ""
+        return remaining
+
 def only_p_tags(text):
     descriptions = re.findall(r"<p>(.*?)</p>", text)
     return descriptions
 
-def get_unique_content_only(results):
-    context = ''
-    for search_result in results:
-        for match in search_result["matches"]:
-            if match['metadata']['text'] not in context:
-                context += f"- {match['metadata']['text']}\n"
-    return context
-
-def retrieve_context(description, embedding_model, index, top_k):
-    results = []
-    for desc in description:
-        query_vector = embedding_model.encode(desc).tolist()
-        search_results = index.query(vector=query_vector, top_k=top_k, include_metadata=True)
-        results.append(search_results)
-    return results
-
-def chunk_text(text, tokenizer, max_tokens):
-    words = text.split()
-    chunks = []
-    current_chunk = []
-    token_count = 0
-
-    for word in words:
-        word_tokens = len(tokenizer.encode(word))
-        if token_count + word_tokens > max_tokens:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = []
-            token_count = 0
-        current_chunk.append(word)
-        token_count += word_tokens
-
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-
-    return chunks
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+def encode_texts(texts, embedding_model):
+    """Encode texts in one batched forward pass, reusing cached vectors.
+
+    Vectors are cached per model by a hash of the text, so repeated
+    descriptions (the same report resubmitted, batch duplicates) skip the
+    encoder entirely.
+    """
+    keys = [(id(embedding_model), hashlib.sha1(text.encode("utf-8")).hexdigest()) for text in texts]
+    vectors = {}
+    with _embedding_cache_lock:
+        for key in keys:
+            if key in _embedding_cache:
+                _embedding_cache.move_to_end(key)
+                vectors[key] = _embedding_cache[key]
+    missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+    if missing:
+        text_for_key = dict(zip(keys, texts))
+        encoded = embedding_model.encode([text_for_key[key] for key in missing])
+        with _embedding_cache_lock:
+            for key, vector in zip(missing, encoded):
+                vectors[key] = vector
+                _embedding_cache[key] = vector
+            while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+                _embedding_cache.popitem(last=False)
+    return [vectors[key] for key in keys]
+
+def query_index(index, vector, top_k, include_values=None):
+    # Values are only needed when select_context does near-duplicate removal or MMR.
+    if include_values is None:
+        include_values = uses_match_vectors()
+    return index.query(vector=vector.tolist(), top_k=top_k, include_metadata=True, include_values=include_values)
+
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "0"))
+SENTENCE_END = re.compile(rb"[.!?](?=\s)")
+
+class TokenLengths(dict):
+    """Byte length of each token id, filled in on first use."""
+
+    def __init__(self, tokenizer):
+        super().__init__()
+        self.tokenizer = tokenizer
+
+    def __missing__(self, token):
+        length = self[token] = len(self.tokenizer.decode_single_token_bytes(token))
+        return length
+
+_token_lengths = {}
+
+def _char_start(data, offset):
+    """Move a byte offset back to the start of the UTF-8 character it falls in.
+
+    Byte-level tokens can split a multibyte character ("µ", "°", non-Latin
+    text) between two windows; snapping both windows' edges puts it whole in
+    the later one.
+    """
+    while 0 < offset < len(data) and (data[offset] & 0xC0) == 0x80:
+        offset -= 1
+    return offset
+
+def _chunk_document(text, tokenizer, max_tokens, overlap, snap_to_sentences):
+    tokens = tokenizer.encode(text)
+    if not tokens:
+        return
+    # Work on UTF-8 byte offsets; tiktoken encodes losslessly, so they index text.encode().
+    data = text.encode("utf-8")
+    lengths = _token_lengths.setdefault(id(tokenizer), TokenLengths(tokenizer))
+    offsets = [0, *itertools.accumulate(map(lengths.__getitem__, tokens))]
+    boundaries = []
+    if snap_to_sentences:
+        boundaries = [bisect.bisect_left(offsets, m.end()) for m in SENTENCE_END.finditer(data)]
+
+    start = 0
+    while start < len(tokens):
+        end = min(start + max_tokens, len(tokens))
+        if end < len(tokens) and boundaries:
+            # Last sentence end in the second half of the window, if any.
+            i = bisect.bisect_right(boundaries, end) - 1
+            if i >= 0 and boundaries[i] > start + max_tokens // 2:
+                end = boundaries[i]
+        chunk = data[_char_start(data, offsets[start]):_char_start(data, offsets[end])].decode("utf-8").strip()
+        if chunk:
+            yield chunk
+        if end == len(tokens):
+            break
+        start = max(end - overlap, start + 1)
+
+def iter_chunks(texts, tokenizer, max_tokens, overlap=CHUNK_OVERLAP, snap_to_sentences=True):
+    """Yield chunks of at most max_tokens tokens from a stream of documents.
+
+    Each document is encoded once and its token array sliced into windows,
+    so counts are exact for the text in context. Windows end on a sentence
+    boundary when one falls in their second half, and consecutive windows
+    share ``overlap`` tokens.
+    """
+    for text in texts:
+        yield from _chunk_document(text, tokenizer, max_tokens, overlap, snap_to_sentences)
+
+def chunk_text(text, tokenizer, max_tokens, overlap=CHUNK_OVERLAP, snap_to_sentences=True):
+    return list(iter_chunks([text], tokenizer, max_tokens, overlap, snap_to_sentences))
 
 def scrape_and_extract(url):
     try:
@@ -69,71 +191,113 @@ def scrape_and_extract(url):
         logging.error(f"Error fetching {url}: {e}")
         return None
 
-def clean_text(text):
-    if not text:
-        return ""
-    soup = BeautifulSoup(text, "html.parser")
-    text = soup.get_text()
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
-
-def get_URLs(test_name, SERPER_API_KEY):
-    search_query = f"How to interpret {test_name} report"
-    payload = json.dumps({"q": search_query, "num": 2})
-    headers = {'X-API-KEY': SERPER_API_KEY, 'Content-Type': 'application/json'}
-    url = "https://google.serper.dev/search"
-    try:
-        response = requests.post(url, headers=headers, data=payload)
-        response.raise_for_status()
-        data = response.json()
-        urls = [entry["link"] for entry in data.get("organic", [])]
-        logging.info(f"URLs:, {urls}")
-        return urls
-    except requests.RequestException as e:
-        logging.error(f"Error fetching URLs: {e}")
-        return []
-
-def get_interpretations_list(test_name, urls, chat, tokenizer, max_tokens):
-    extracted_texts = []
-    for url in urls:
-        content = scrape_and_extract(url)
-        logging.info(f"Extracted content from {content}")
-        if content:
-            cleaned_text = clean_text(content)
-            extracted_texts.append(cleaned_text)
-
-    web_content = "\n\n".join(extracted_texts)
-    logging.info(f"Web content: {web_content}")
-    web_content_chunks = chunk_text(web_content, tokenizer, max_tokens)
-
-    responses = []
-    for chunk in web_content_chunks:
-        messages = [
-            SystemMessage(content="You are a medical expert providing the relevant content from the given one."),
-            HumanMessage(content=f"""Based on the following information:\n\n{chunk}\n\n extract the information
-            that can help in interpreting the medical report related to {test_name} (test). Don't type 
-            anything else. Just provide the relevant information from the content nothing else, if there
-            is nothing relevant then just respond with 'there is nothing helpful' but don't type anything from your knowledge.""")
-        ]
-        response = chat(messages)
-        response = remove_tags(response.content)
-        responses.append(response)
-    return responses
-
-def summarize_web_content(list_of_interpretations, test_name, chat):
-    interpretations = "".join(list_of_interpretations)
-    chain = chat | StrOutputParser()
-    prompt = f"""You are a medical expert. Summarize the provided content in a maximum of 1000 words to aid 
+def clean_text(text, url=None):
+    # Main content only: navigation, banners and footers would otherwise become paid LLM chunks.
+    return extract_main_text(text, url)
+
+def interpretation_messages(chunk, test_name):
+    return [
+        SystemMessage(content="You are a medical expert providing the relevant content from the given one."),
+        HumanMessage(content=f"""Based on the following information:\n\n{chunk}\n\n extract the information
+        that can help in interpreting the medical report related to {test_name} (test). Don't type 
+        anything else. Just provide the relevant information from the content nothing else, if there
+        is nothing relevant then just respond with 'there is nothing helpful' but don't type anything from your knowledge.""")
+    ]
+
+NOTHING_HELPFUL = "there is nothing helpful"
+
+def is_unhelpful(text):
+    """True for an empty extraction or the 'there is nothing helpful' reply the prompt asks for."""
+    text = (text or "").strip()
+    return not text or (len(text) < 100 and NOTHING_HELPFUL in text.lower())
+
+def prepare_chunks(test_name, extracted_texts, tokenizer, max_tokens):
+    """Drop paragraphs repeated across the fetched pages, then chunk what is left."""
+    extracted_texts, removed, saved_tokens = dedupe_documents(extracted_texts, tokenizer)
+    logging.info(f"Removed {removed} near-duplicate paragraphs for {test_name} ({saved_tokens} tokens saved)")
+    web_content = "\n\n".join(text for text in extracted_texts if text)
+    return chunk_text(web_content, tokenizer, max_tokens)
+
+SUMMARY_BATCH_TOKENS = int(os.getenv("SUMMARY_BATCH_TOKENS", "6000"))
+SUMMARY_FAN_IN = int(os.getenv("SUMMARY_FAN_IN", "8"))
+SUMMARY_MAX_DEPTH = int(os.getenv("SUMMARY_MAX_DEPTH", "3"))
+
+def summarize_prompt(list_of_interpretations, test_name):
+    interpretations = "\n\n".join(list_of_interpretations)
+    return f"""You are a medical expert. Summarize the provided content in a maximum of 1000 words to aid 
     in interpreting the medical report related to {test_name}. Ensure the summary remains within the word 
     limit while retaining key insights.
 
     Content: {interpretations}"""
-    response = chain.invoke(prompt)
-    response = remove_tags(response)
-    return response
 
-def generate_refined_prompt(query, type, disease, chat):
-    prompt = f"""You are an expert doctor. I have provided the test type, 
+def batch_by_tokens(texts, tokenizer, max_tokens=SUMMARY_BATCH_TOKENS, max_items=SUMMARY_FAN_IN):
+    """Group texts in order into batches of at most max_tokens tokens and max_items texts."""
+    batches, current, used = [], [], 0
+    for text in texts:
+        tokens = len(tokenizer.encode(text))
+        if current and (used + tokens > max_tokens or len(current) == max_items):
+            batches.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def truncate_to_budget(texts, tokenizer, max_tokens=SUMMARY_BATCH_TOKENS):
+    kept, used = [], 0
+    for text in texts:
+        used += len(tokenizer.encode(text))
+        if kept and used > max_tokens:
+            break
+        kept.append(text)
+    return kept
+
+class ReportTokenStats:
+    """Report tokens per prompt stage: as received from the client and as sent (compact_report)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def record(self, stage, raw_tokens, sent_tokens):
+        with self.lock:
+            counts = self.stages.setdefault(stage, {"prompts": 0, "raw_tokens": 0, "sent_tokens": 0})
+            counts["prompts"] += 1
+            counts["raw_tokens"] += raw_tokens
+            counts["sent_tokens"] += sent_tokens
+
+    def stats(self):
+        with self.lock:
+            stages = {stage: dict(counts) for stage, counts in self.stages.items()}
+        for counts in stages.values():
+            counts["saved_tokens"] = counts["raw_tokens"] - counts["sent_tokens"]
+            counts["saved_share"] = round(counts["saved_tokens"] / counts["raw_tokens"], 3) if counts["raw_tokens"] else 0.0
+        return stages
+
+
+report_token_stats = ReportTokenStats()
+
+
+@functools.lru_cache(maxsize=256)
+def _compact_report(report):
+    compact = compact_report(report, analyze_report(report)[0])
+    tokenizer = default_tokenizer()
+    return compact, len(tokenizer.encode(report)), len(tokenizer.encode(compact))
+
+
+def prompt_report(report, stage):
+    """The report as it goes into the ``stage`` prompt; the same report is compacted once for all stages."""
+    if not isinstance(report, str) or not report:
+        return report
+    compact, raw_tokens, sent_tokens = _compact_report(report)
+    report_token_stats.record(stage, raw_tokens, sent_tokens)
+    logging.info(f"Report in {stage} prompt: {sent_tokens} tokens (received {raw_tokens})")
+    return compact
+
+
+def refined_prompt(query, type, disease):
+    return f"""You are an expert doctor. I have provided the test type, 
     the suspected disease (if mentioned by the patient), and the lab report. Since the lab report 
     primarily consists of numerical values, retrieving relevant context from my RAG system is challenging.
     Your task is to generate a maximum of 200-300 words textual summary that best represents this report,
@@ -149,23 +313,18 @@ def generate_refined_prompt(query, type, disease, chat):
     
     Type: {type}
     Disease: {disease}
-    Report: {query}
+    Report: {prompt_report(query, "refined")}
         
     Answer:
     """
-    chain = chat | StrOutputParser()
-    response = chain.invoke(prompt)
-    response = remove_tags(response)
-    response = only_p_tags(response)
-    return response
-
-def discard_irrelevant_context(test_name, normal_ranges, retrieved_context, report, web_content, chat):
-    prompt = f"""You are an expert doctor. Your task is to extract only the most relevant 
+
+def discard_prompt(test_name, normal_ranges, retrieved_context, report, web_content):
+    return f"""You are an expert doctor. Your task is to extract only the most relevant 
     information from the provided medical context and discard anything unrelated.  
 
 ### Given Information:
 - **Test Type:** {test_name}  
-- **Medical Report:** {report}  
+- **Medical Report:** {prompt_report(report, "discard")}  
 - **Normal Ranges:** {normal_ranges}  
 - **Context:** {retrieved_context} \n {web_content}  
 
@@ -179,13 +338,10 @@ def discard_irrelevant_context(test_name, normal_ranges, retrieved_context, repo
 ### Output Format:
 Return the **filtered context** as clean paragraphs that are relevant to {test_name}. Do not include any unrelated information, just provide the paragraphs nothing else.  
 """
-    chain = chat | StrOutputParser()
-    response = chain.invoke(prompt)
-    response = remove_tags(response)
-    return response
 
-def generate_final_output(report, type, disease, generated_text, context, chat):
-    prompt = f"""You are an expert doctor. You have to interpret the medical lab report of the patient. I have provided 
+def final_output_prompt(report, type, disease, generated_text, context, normal_ranges=None):
+    ranges = f"\n    Reference ranges (only for values the report prints no range for): {normal_ranges}" if normal_ranges else ""
+    return f"""You are an expert doctor. You have to interpret the medical lab report of the patient. I have provided 
     you the lab report, the test type, the disease which the patient thinks he is suffering from and some context which may assist you in interpreting the report.
     Interpret the report in layman understandable form in just 2 lines, not more than that and do not write anything else other than the interpretation. If you think that
     the disease he thinks he is suffering from does not match the report, you can mention that as well and recommend the possible diseases. In case the Context is not beneficial,
@@ -195,46 +351,10 @@ def generate_final_output(report, type, disease, generated_text, context, chat):
     Context: {context}
     Type: {type}
     Disease: {disease}
-    Report: {report}
+    Report: {prompt_report(report, "final")}{ranges}
     Random Context (it can be wrong): {generated_text}
     Answer:
     """
-    chain = chat | StrOutputParser()
-    response = chain.invoke(prompt)
-    response = remove_tags(response)
-    return response
-
-def web_search(test_name, chat1,chat2, SERPER_API_KEY, tokenizer, max_tokens):
-    try:
-        urls = get_URLs(test_name, SERPER_API_KEY)
-        interpretation = get_interpretations_list(test_name, urls, chat1, tokenizer, max_tokens)
-        text = summarize_web_content(interpretation, test_name, chat2)
-        logging.info("Web search completed")
-        return text
-    except Exception as e:
-        logging.error(f"Error during web search: {e}")
-        return ""
-
-def VDB_search(test_name, report, chat2, disease, embedding_model, index, top_k=5):
-    try:
-        generated_text = generate_refined_prompt(report, test_name, disease, chat2)
-        retrieved_content = retrieve_context(generated_text, embedding_model, index, top_k)
-        unique_content = get_unique_content_only(retrieved_content)
-        logging.info("VDB search completed")
-        return unique_content, generated_text
-    except Exception as e:
-        logging.error(f"Error during VDB search: {e}")
-        return "", ""
-
-def final_output(test_name, unique_content, report, text, disease, generated_text, chat1,chat2, normal_ranges):
-    try:
-        context = discard_irrelevant_context(test_name, normal_ranges, unique_content, report, text, chat1)
-        response = generate_final_output(report, test_name, disease, generated_text, context, chat2)
-        return response
-    except Exception as e:
-        logging.error(f"Error generating final output: {e}")
-        return ""
-
 
 from pydantic import BaseModel, Field
 from typing import List
@@ -347,7 +467,7 @@ def vanilla_model_to_interpret_report(report: str, type: str, disease: str, chat
     
     Type: {type}
     Disease: {disease}
-    Report: {report}
+    Report: {prompt_report(report, "vanilla")}
     """
 
     try:
@@ -0,0 +1,321 @@
+"""Deterministic reading of extracted lab reports.
+
+The /chat ``report`` is the JSON that /extract-lab-report returned: a
+LabReport with ``entries`` (field_name/field_value pairs) or ``table_data``
+rows, or occasionally plain "Name: value unit (range)" text. parse_report
+turns any of these into Measurements with a numeric value, unit, printed
+reference range and a flag, and describe_report builds the two retrieval
+descriptions from templates instead of asking the LLM for them
+(agenerate_refined_prompt). Reports that do not parse into enough flagged
+measurements (narrative reports) return None, and the caller keeps the LLM
+path for them.
+
+compact_report is the form of the report that goes into the prompts: a
+pipe table instead of the JSON with its repeated keys, quotes and braces.
+"""
+import json
+import logging
+import os
+import re
+from typing import List, Optional
+from pydantic import BaseModel
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# on | off
+LOCAL_REPORT_ANALYSIS = os.getenv("LOCAL_REPORT_ANALYSIS", "on")
+# Below half the lower limit or above three times the upper limit counts as critical.
+CRITICAL_LOW_FACTOR = 0.5
+CRITICAL_HIGH_FACTOR = 3.0
+# Share of the report's entries that must parse as flagged measurements for the local path.
+MIN_FLAGGED_SHARE = 0.5
+
+NAME_KEYS = {"test", "test name", "parameter", "investigation", "analyte", "component", "name", "description"}
+VALUE_KEYS = {"result", "results", "value", "observed value", "observation", "your value"}
+UNIT_KEYS = {"unit", "units", "uom"}
+FLAG_KEYS = {"flag", "status", "remark", "remarks", "interpretation"}
+RANGE_WORDS = ("range", "reference", "interval", "normal", "ref")
+# Entries that describe the patient or the sample rather than an analyte. Matched on the whole
+# field name: "Prothrombin Time" and "Bleeding Time" are analytes, "Reported Time" is not.
+AGE_KEYS = {"age", "patient age", "age years", "age yrs"}
+SEX_KEYS = {"sex", "gender", "patient sex", "patient gender"}
+AGE_SEX_KEYS = {"age sex", "age gender", "sex age", "gender age"}
+METADATA_KEYS = {
+    "name", "patient", "patient name", "patient id", "id", "uhid", "mrn", "reg no", "registration no", "lab no", "bill no",
+    "sample", "sample id", "sample no", "sample type", "specimen", "specimen type", "specimen id",
+    "date", "report date", "collected", "collected on", "collected at", "collection date", "collection time",
+    "received", "received on", "received time", "reported", "reported on", "reported time", "registered on",
+    "doctor", "dr", "ref by", "referred by", "ref doctor", "referring doctor", "physician", "consultant",
+    "lab", "lab name", "laboratory", "hospital", "address", "phone", "mobile", "method",
+}
+
+NUMBER = r"-?\d+(?:\.\d+)?"
+VALUE_PATTERN = re.compile(rf"([<>]=?|≤|≥)?\s*({NUMBER})")
+UNIT_PATTERN = re.compile(r"^\s*((?:x\s*)?10\^?\d+\s*/\s*[a-zA-Zµμ]+|[a-zA-Zµμ%/][a-zA-Zµμ0-9%/.^*]*)")
+RANGE_BETWEEN = re.compile(rf"({NUMBER})\s*(?:-|–|—|to)\s*({NUMBER})", re.I)
+RANGE_UPPER = re.compile(rf"(?:<=?|≤|up to|below|less than)\s*({NUMBER})", re.I)
+RANGE_LOWER = re.compile(rf"(?:>=?|≥|above|more than|greater than)\s*({NUMBER})", re.I)
+FLAG_WORDS = {"low": "low", "high": "high", "critical-low": "critically low", "critical-high": "critically high", "critical": "critical"}
+PRINTED_FLAGS = {"h": "high", "high": "high", "l": "low", "low": "low", "hh": "critical-high", "ll": "critical-low", "critical": "critical"}
+
+
+class Measurement(BaseModel):
+    name: str
+    value: Optional[float] = None
+    unit: str = ""
+    low: Optional[float] = None
+    high: Optional[float] = None
+    reference: str = ""
+    flag: str = "unknown"
+    # The value as printed when it says more than value and unit ("<0.01", "2-4 /hpf", "Grade 2 fatty liver").
+    text: str = ""
+
+
+class ReportAnalysis(BaseModel):
+    measurements: List[Measurement]
+    entries: int
+    # "name: value" text of the entries that are not measurements (findings, impressions).
+    notes: List[str] = []
+    age: Optional[float] = None
+    sex: Optional[str] = None
+    report_type: str = ""
+
+    @property
+    def flagged(self):
+        return [m for m in self.measurements if m.flag != "unknown"]
+
+    @property
+    def abnormal(self):
+        return [m for m in self.measurements if m.flag not in ("normal", "unknown")]
+
+    def is_tabular(self):
+        if self.report_type == "descriptive" or not self.flagged:
+            return False
+        return len(self.flagged) >= MIN_FLAGGED_SHARE * max(self.entries, 1)
+
+
+def strip_thousands(text):
+    return re.sub(r"(?<=\d),(?=\d{3}\b)", "", text)
+
+
+def parse_range(text):
+    """Return (low, high) from printed reference text like '13.5-17.5', '< 200' or '>= 40'."""
+    text = strip_thousands(text or "")
+    match = RANGE_BETWEEN.search(text)
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    match = RANGE_UPPER.search(text)
+    if match:
+        return None, float(match.group(1))
+    match = RANGE_LOWER.search(text)
+    if match:
+        return float(match.group(1)), None
+    return None, None
+
+
+def classify(value, low, high):
+    if value is None or (low is None and high is None):
+        return "unknown"
+    if low is not None and value < low:
+        return "critical-low" if value < low * CRITICAL_LOW_FACTOR else "low"
+    if high is not None and value > high:
+        return "critical-high" if value > high * CRITICAL_HIGH_FACTOR else "high"
+    return "normal"
+
+
+def parse_measurement(name, text, unit="", reference="", printed_flag=""):
+    """Parse '9.1 g/dL (13.5-17.5) L' style text, with optional separately printed unit/range/flag."""
+    text = strip_thousands(str(text or ""))
+    if not reference:
+        match = re.search(r"\(([^)]*\d[^)]*)\)|(?:ref(?:erence)?(?: range)?|normal(?: range)?)\s*[:\-]?\s*(.+)$", text, re.I)
+        if match:
+            reference = (match.group(1) or match.group(2)).strip()
+            text = text[:match.start()] + text[match.end():]
+    match = VALUE_PATTERN.search(text)
+    value = float(match.group(2)) if match else None
+    rest = text[match.end():] if match else ""
+    if match and not unit:
+        unit_match = UNIT_PATTERN.match(rest)
+        if unit_match and unit_match.group(1).lower() not in PRINTED_FLAGS:
+            unit = unit_match.group(1)
+            # The "L" of "mmol/L" is not a low flag.
+            rest = rest[unit_match.end():]
+    trailing_flag = ""
+    if match:
+        trailing = re.findall(r"\b([A-Za-z]+)\b", rest)
+        trailing_flag = next((word for word in trailing if word.lower() in PRINTED_FLAGS), "")
+        printed_flag = printed_flag or trailing_flag
+    # Anything besides the number, unit and flag (a comparator, a second number, words) is kept as printed.
+    leftover = (text[:match.start()] + rest.replace(trailing_flag, "", 1)) if match else text
+    verbatim = text.strip() if match and (match.group(1) or re.search(r"\w", leftover)) else ""
+    low, high = parse_range(reference)
+    flag = classify(value, low, high)
+    if flag == "unknown" and value is not None:
+        flag = PRINTED_FLAGS.get(str(printed_flag).strip().lower(), "unknown")
+    return Measurement(name=name.strip(), value=value, unit=unit.strip(), low=low, high=high, reference=reference, flag=flag, text=verbatim)
+
+
+def _field_key(key):
+    """'Ref. By:' -> 'ref by'."""
+    return re.sub(r"[\W_]+", " ", key).strip().lower()
+
+
+def _key_kind(key):
+    key = key.strip().lower()
+    if key in NAME_KEYS:
+        return "name"
+    if key in VALUE_KEYS:
+        return "value"
+    if key in UNIT_KEYS:
+        return "unit"
+    if key in FLAG_KEYS:
+        return "flag"
+    if any(word in key for word in RANGE_WORDS):
+        return "range"
+    return None
+
+
+def _row_measurement(row):
+    """A table row: one column per kind, or a single {analyte: 'value unit (range)'} pair."""
+    columns = {}
+    for key, value in row.items():
+        kind = _key_kind(str(key))
+        if kind and kind not in columns:
+            columns[kind] = str(value)
+    if "name" in columns and "value" in columns:
+        return parse_measurement(columns["name"], columns["value"], columns.get("unit", ""), columns.get("range", ""), columns.get("flag", ""))
+    others = [(key, value) for key, value in row.items() if _key_kind(str(key)) is None]
+    if len(others) == 1:
+        key, value = others[0]
+        return parse_measurement(str(key), value, columns.get("unit", ""), columns.get("range", ""), columns.get("flag", ""))
+    return None
+
+
+def _rows_from_text(text):
+    for line in re.split(r"[\n;]+", text):
+        if ":" in line:
+            name, value = line.split(":", 1)
+            yield {name: value}
+
+
+def parse_report(report):
+    """Parse the /chat report string (LabReport JSON or 'name: value' text) into a ReportAnalysis."""
+    try:
+        data = json.loads(report)
+    except (TypeError, ValueError):
+        data = None
+
+    report_type = ""
+    if isinstance(data, dict):
+        report_type = str(data.get("report_type", "")).lower()
+        rows = data.get("entries") or data.get("table_data") or []
+    elif isinstance(data, list):
+        rows = data
+    else:
+        rows = list(_rows_from_text(str(report)))
+
+    measurements, notes, age, sex = [], [], None, None
+    entries = 0
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        if "field_name" in row and "field_value" in row:
+            name, value = str(row["field_name"]), str(row["field_value"])
+            kind = _key_kind(name)
+            # Unit/range/flag printed as their own entries belong to the previous analyte.
+            if kind in ("unit", "range", "flag") and measurements and _field_key(name) not in METADATA_KEYS:
+                previous = measurements[-1]
+                measurements[-1] = parse_measurement(
+                    previous.name, previous.text or (f"{previous.value}" if previous.value is not None else ""),
+                    value if kind == "unit" else previous.unit,
+                    value if kind == "range" else previous.reference,
+                    value if kind == "flag" else "",
+                )
+                continue
+            row = {name: value}
+        key = str(next(iter(row), ""))
+        field = _field_key(key)
+        if len(row) == 1 and field in AGE_KEYS | AGE_SEX_KEYS:
+            age = parse_measurement(key, row[key]).value
+        if len(row) == 1 and field in SEX_KEYS | AGE_SEX_KEYS:
+            sex = "female" if re.search(r"\bf", str(row[key]), re.I) else "male"
+        if len(row) == 1 and field in AGE_KEYS | SEX_KEYS | AGE_SEX_KEYS | METADATA_KEYS:
+            continue
+        entries += 1
+        measurement = _row_measurement(row)
+        if measurement is not None and measurement.value is not None:
+            measurements.append(measurement)
+        else:
+            notes.append(", ".join(f"{key}: {value}" for key, value in row.items() if str(value).strip()))
+    return ReportAnalysis(measurements=measurements, entries=entries, notes=notes, age=age, sex=sex, report_type=report_type)
+
+
+def _describe(measurement):
+    reference = f", reference {measurement.reference}" if measurement.reference else ""
+    return f"{FLAG_WORDS[measurement.flag]} {measurement.name} ({measurement.value:g} {measurement.unit}".rstrip() + f"{reference})"
+
+
+def _join(items):
+    return items[0] if len(items) == 1 else ", ".join(items[:-1]) + " and " + items[-1]
+
+
+def describe_report(report, test_name, disease="", analysis=None):
+    """Two retrieval descriptions built from templates, or None when the report needs the LLM."""
+    analysis = analysis or parse_report(report)
+    if not analysis.is_tabular():
+        return None
+    abnormal = analysis.abnormal
+    normal = [m.name for m in analysis.flagged if m.flag == "normal"]
+    suspected = f" The patient suspects {disease}." if disease else ""
+    if abnormal:
+        findings = (
+            f"The {test_name} report shows {_join([_describe(m) for m in abnormal])}."
+            + (f" {_join(normal)} {'is' if len(normal) == 1 else 'are'} within the normal range." if normal else "")
+            + suspected
+        )
+        names = _join([f"{m.flag.split('-')[-1]} {m.name}" for m in abnormal])
+        meaning = (
+            f"What {names} mean in a {test_name} test: common causes, associated conditions"
+            + (f" such as {disease}" if disease else "")
+            + ", symptoms and the follow-up tests usually recommended."
+        )
+    else:
+        findings = f"All measured values of the {test_name} report ({_join(normal)}) are within their reference ranges.{suspected}"
+        meaning = f"How to interpret a normal {test_name} result and when {test_name} values are considered abnormal" + (f", including in {disease}." if disease else ".")
+    logging.info(f"Described {test_name} report locally: {len(abnormal)} abnormal of {len(analysis.flagged)} flagged measurements")
+    return [findings, meaning]
+
+
+def _compact_row(measurement):
+    value = measurement.text or f"{measurement.value:g}"
+    unit = "" if measurement.text and measurement.unit in measurement.text else measurement.unit
+    flag = "" if measurement.flag == "unknown" else measurement.flag
+    return f"{measurement.name} | {value} | {unit} | {measurement.reference} | {flag}"
+
+
+def compact_report(report, analysis=None):
+    """The report as 'analyte | value | unit | range | flag' rows plus note lines, for prompts.
+
+    Values and ranges keep their printed text whenever the parse did not
+    account for all of it. Patient and sample metadata other than age and
+    sex is left out. Descriptive reports and reports that are not JSON
+    (already compact or free text) are returned unchanged.
+    """
+    try:
+        data = json.loads(report)
+    except (TypeError, ValueError):
+        return report
+    if not isinstance(data, (dict, list)):
+        return report
+    analysis = analysis or parse_report(report)
+    if analysis.report_type == "descriptive":
+        return report
+    lines = []
+    patient = [analysis.sex or "", f"{analysis.age:g} years" if analysis.age is not None else ""]
+    if any(patient):
+        lines.append("Patient: " + ", ".join(p for p in patient if p))
+    if analysis.measurements:
+        lines.append("analyte | value | unit | range | flag")
+        lines.extend(_compact_row(m) for m in analysis.measurements)
+    lines.extend(analysis.notes)
+    return "\n".join(lines) or report
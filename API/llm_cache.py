@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# off | readwrite | record | replay
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "readwrite")
+
+MODES = ("off", "readwrite", "record", "replay")
+# Hits queue their last_access update and write it with the next insert, or once this many are pending.
+TOUCH_BATCH_SIZE = 64
+
+
+class LLMCacheMiss(LookupError):
+    """Raised in replay mode when a prompt has no recorded response."""
+
+
+class DiskLLMCache(BaseCache):
+    """SQLite-backed LangChain cache for the ChatGroq clients.
+
+    Pass it as ``ChatGroq(cache=...)`` and every ``invoke``/``ainvoke`` made
+    through the client (including ``chat | StrOutputParser()`` chains) is
+    looked up by a hash of the model configuration and the prompt first.
+    LangChain does not consult the cache for ``stream``/``astream``; see
+    async_functions.astream_final_output for how /chat/stream handles that.
+
+    Modes:
+    - ``readwrite``: serve hits, call the model and store on a miss.
+    - ``record``: always call the model and overwrite the stored response.
+    - ``replay``: only serve stored responses; a miss raises LLMCacheMiss,
+      which makes the store usable as a fixture set for offline runs.
+    - ``off``: bypass the store entirely.
+
+    The file is kept under ``max_bytes`` by evicting least recently used rows.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_BYTES, mode=LLM_CACHE_MODE):
+        if mode not in MODES:
+            raise ValueError(f"Unknown LLM cache mode '{mode}', expected one of {MODES}")
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS generations (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS generations_last_access ON generations(last_access)")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        self.touched = {}
+
+    @staticmethod
+    def make_key(prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        if self.mode in ("off", "record"):
+            return None
+        key = self.make_key(prompt, llm_string)
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.touched[key] = time.time()
+                if len(self.touched) >= TOUCH_BATCH_SIZE:
+                    self._flush_touched()
+                    self.connection.commit()
+        if row is None:
+            self.misses += 1
+            if self.mode == "replay":
+                raise LLMCacheMiss(f"No recorded response for prompt {key[:12]}")
+            return None
+        self.hits += 1
+        return [loads(generation) for generation in row[0].split("\x1e")]
+
+    def update(self, prompt, llm_string, return_val):
+        if self.mode in ("off", "replay"):
+            return
+        key = self.make_key(prompt, llm_string)
+        value = "\x1e".join(dumps(generation) for generation in return_val)
+        size = len(value.encode("utf-8"))
+        with self.lock:
+            old = self.connection.execute("SELECT size FROM generations WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO generations (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self.touched.pop(key, None)
+            self._flush_touched()
+            self._evict()
+            self.connection.commit()
+
+    def _flush_touched(self):
+        if self.touched:
+            self.connection.executemany(
+                "UPDATE generations SET last_access = ? WHERE key = ?",
+                [(last_access, key) for key, last_access in self.touched.items()],
+            )
+            self.touched.clear()
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # Other workers may share the file; recount before evicting on the running estimate.
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        rows = self.connection.execute("SELECT key, size FROM generations ORDER BY last_access")
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.connection.executemany("DELETE FROM generations WHERE key = ?", evicted)
+
+    # ainvoke/astream run on the event loop, and the lock may be held by a blocking caller (process_image).
+    async def alookup(self, prompt, llm_string):
+        return await asyncio.to_thread(self.lookup, prompt, llm_string)
+
+    async def aupdate(self, prompt, llm_string, return_val):
+        await asyncio.to_thread(self.update, prompt, llm_string, return_val)
+
+    def clear(self, **kwargs):
+        with self.lock:
+            self.connection.execute("DELETE FROM generations")
+            self.connection.commit()
+            self.total_bytes = 0
+            self.touched.clear()
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        return {"mode": self.mode, "entries": entries, "bytes": self.total_bytes, "hits": self.hits, "misses": self.misses}
+
+
+def create_llm_cache(mode=LLM_CACHE_MODE):
+    if mode == "off":
+        return None
+    return DiskLLMCache(mode=mode)
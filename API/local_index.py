@@ -0,0 +1,250 @@
+"""In-process replacement for the Pinecone ``medical-data`` index.
+
+The corpus (MedlinePlus, testing.com and book chunks embedded with
+msmarco-bert-base-dot-v5) is small enough to keep in RAM, so queries can be
+answered locally instead of paying a network round trip per description.
+
+Build it once from the embedded CSVs that Pinecone.ipynb uploads:
+
+    python local_index.py build --out local_index medlinePlus_tokens_325.csv testing_com_tokens_325.csv books_embeddings.csv
+
+and point the API at it with VECTOR_INDEX=local LOCAL_INDEX_PATH=local_index.
+Add ``--quantize int8`` (or float16) to also write a compressed copy that a
+worker can keep resident at a quarter (or half) of the float32 size.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+VECTORS_FILE = "vectors.npy"
+QUANTIZED_FILES = {"int8": "vectors.int8.npy", "float16": "vectors.float16.npy"}
+SCALES_FILE = "scales.npy"
+# Rows dequantized per block in quantized search; small enough for the float32
+# block to stay in cache, which is what makes int8 scoring competitive.
+BLOCK_ROWS = 256
+METADATA_FILE = "metadata.jsonl"
+INFO_FILE = "index.json"
+GRAPH_FILE = "graph.bin"
+
+METADATA_COLUMNS = {"test_name": "Test Name", "source": "Source", "url": "URL", "text": "text"}
+
+
+def read_embedded_csv(path):
+    """Yield (vector, metadata) rows from one of the ingestion CSVs."""
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            # The tokens column is a Python list literal of floats, which is also valid JSON.
+            vector = json.loads(row["tokens"])
+            metadata = {key: row.get(column) or "" for key, column in METADATA_COLUMNS.items()}
+            yield vector, metadata
+
+
+def quantize(matrix, storage):
+    """Return (codes, scales) for the given storage type.
+
+    int8 uses a symmetric per-vector scale (max |x| / 127), so each row
+    keeps its own dynamic range; float16 needs no scale.
+    """
+    if storage == "float16":
+        return matrix.astype(np.float16), None
+    if storage == "int8":
+        scales = np.maximum(np.abs(matrix).max(axis=1), 1e-12) / 127.0
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown storage type '{storage}'")
+
+
+def write_quantized(matrix, out_dir, storage):
+    codes, scales = quantize(matrix, storage)
+    np.save(os.path.join(out_dir, QUANTIZED_FILES[storage]), codes)
+    if scales is not None:
+        np.save(os.path.join(out_dir, SCALES_FILE), scales)
+
+
+def build_local_index(csv_paths, out_dir, metric="cosine", graph=True, quantized=()):
+    """Write the vectors as one float32 matrix plus metadata, optionally with an HNSW graph.
+
+    ``metric`` should match the Pinecone index the data was uploaded to
+    (``medical-data`` was created with cosine); cosine vectors are
+    normalised at build time so queries are a plain dot product.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    vectors = []
+    with open(os.path.join(out_dir, METADATA_FILE), "w", encoding="utf-8") as meta_file:
+        for path in csv_paths:
+            count = 0
+            for vector, metadata in read_embedded_csv(path):
+                metadata["id"] = str(len(vectors))
+                vectors.append(vector)
+                meta_file.write(json.dumps(metadata) + "\n")
+                count += 1
+            logging.info(f"Loaded {count} vectors from {path}")
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if metric == "cosine":
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    np.save(os.path.join(out_dir, VECTORS_FILE), matrix)
+    with open(os.path.join(out_dir, INFO_FILE), "w") as f:
+        json.dump({"count": int(matrix.shape[0]), "dimension": int(matrix.shape[1]), "metric": metric}, f)
+
+    for storage in quantized:
+        write_quantized(matrix, out_dir, storage)
+    if graph:
+        build_graph(matrix, os.path.join(out_dir, GRAPH_FILE))
+    logging.info(f"Local index written to {out_dir}: {matrix.shape[0]} x {matrix.shape[1]}")
+
+
+def build_graph(matrix, path, m=16, ef_construction=200):
+    try:
+        import hnswlib
+    except ImportError:
+        logging.warning("hnswlib is not installed; skipping the graph index (exact search only)")
+        return
+    graph = hnswlib.Index(space="ip", dim=matrix.shape[1])
+    graph.init_index(max_elements=matrix.shape[0], M=m, ef_construction=ef_construction)
+    graph.add_items(matrix, np.arange(matrix.shape[0]))
+    graph.save_index(path)
+
+
+class LocalIndex:
+    """Answers ``query(vector=..., top_k=..., include_metadata=...)`` like a Pinecone Index.
+
+    mode="exact" scores every row of the memory-mapped matrix with one
+    matrix-vector product; mode="graph" uses the HNSW graph written at build
+    time and falls back to exact search when it is unavailable.
+
+    storage="int8"/"float16" keeps only the quantized copy resident and
+    scores the float32 query against it directly (asymmetric scoring).
+    With rescore > 1 the best ``top_k * rescore`` candidates are re-ranked
+    against the float32 rows, which stay memory-mapped on disk.
+    """
+
+    def __init__(self, path, mode="exact", ef_search=64, storage="float32", rescore=4):
+        with open(os.path.join(path, INFO_FILE)) as f:
+            self.info = json.load(f)
+        self.metric = self.info["metric"]
+        self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        self.storage = storage
+        self.rescore = rescore
+        self.codes = None
+        self.scales = None
+        if storage != "float32":
+            self.codes = np.load(os.path.join(path, QUANTIZED_FILES[storage]))
+            if storage == "int8":
+                self.scales = np.load(os.path.join(path, SCALES_FILE))
+        with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as f:
+            self.metadata = [json.loads(line) for line in f]
+        self.graph = None
+        if mode == "graph":
+            self.graph = self._load_graph(os.path.join(path, GRAPH_FILE), ef_search)
+        self.mode = "graph" if self.graph is not None else "exact"
+        logging.info(f"Loaded local index from {path} ({len(self.metadata)} vectors, {self.mode} search, {storage} storage)")
+
+    def _load_graph(self, path, ef_search):
+        try:
+            import hnswlib
+        except ImportError:
+            logging.warning("hnswlib is not installed; using exact search")
+            return None
+        if not os.path.exists(path):
+            logging.warning(f"No graph index at {path}; using exact search")
+            return None
+        graph = hnswlib.Index(space="ip", dim=self.info["dimension"])
+        graph.load_index(path, max_elements=self.info["count"])
+        graph.set_ef(ef_search)
+        return graph
+
+    def _prepare(self, vector):
+        query = np.asarray(vector, dtype=np.float32)
+        if self.metric == "cosine":
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+        return query
+
+    def search(self, vector, top_k):
+        """Return (row ids, scores) of the top_k rows, best first."""
+        query = self._prepare(vector)
+        top_k = min(top_k, len(self.metadata))
+        if self.graph is not None:
+            labels, distances = self.graph.knn_query(query, k=top_k)
+            # hnswlib's "ip" space reports 1 - dot product.
+            return labels[0], 1.0 - distances[0]
+        if self.codes is None:
+            return self._top(self.vectors @ query, top_k)
+        scores = self._quantized_scores(query)
+        if self.rescore <= 1:
+            return self._top(scores, top_k)
+        candidates, _ = self._top(scores, min(top_k * self.rescore, len(scores)))
+        candidates = np.sort(candidates)  # ascending rows read the memmap sequentially
+        exact = self.vectors[candidates] @ query
+        rows, best = self._top(exact, top_k)
+        return candidates[rows], best
+
+    def _quantized_scores(self, query):
+        scores = np.empty(self.codes.shape[0], dtype=np.float32)
+        buffer = np.empty((BLOCK_ROWS, self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, self.codes.shape[0], BLOCK_ROWS):
+            codes = self.codes[start:start + BLOCK_ROWS]
+            block = buffer[:len(codes)]
+            block[...] = codes
+            np.dot(block, query, out=scores[start:start + len(codes)])
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    @staticmethod
+    def _top(scores, top_k):
+        rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        rows = rows[np.argsort(-scores[rows])]
+        return rows, scores[rows]
+
+    def resident_bytes(self):
+        """Bytes of vector data this index keeps in RAM (the float32 matrix is only mapped)."""
+        if self.codes is None:
+            return self.vectors.nbytes
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def query(self, vector, top_k=5, include_metadata=True, include_values=False, **kwargs):
+        rows, scores = self.search(vector, top_k)
+        matches = []
+        for row, score in zip(rows, scores):
+            match = {"id": self.metadata[row]["id"], "score": float(score)}
+            if include_metadata:
+                match["metadata"] = self.metadata[row]
+            if include_values:
+                match["values"] = self.vectors[row].tolist()
+            matches.append(match)
+        return {"matches": matches, "namespace": ""}
+
+    def describe_index_stats(self):
+        return {"dimension": self.info["dimension"], "total_vector_count": self.info["count"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a local copy of the medical-data vector index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build")
+    build.add_argument("csv_paths", nargs="+")
+    build.add_argument("--out", required=True)
+    build.add_argument("--metric", choices=["cosine", "dotproduct"], default="cosine")
+    build.add_argument("--no-graph", action="store_true")
+    build.add_argument("--quantize", action="append", choices=sorted(QUANTIZED_FILES), default=[])
+    requantize = subparsers.add_parser("quantize", help="add a quantized copy to an existing index")
+    requantize.add_argument("index_path")
+    requantize.add_argument("--storage", choices=sorted(QUANTIZED_FILES), required=True)
+    args = parser.parse_args()
+    if args.command == "quantize":
+        matrix = np.load(os.path.join(args.index_path, VECTORS_FILE), mmap_mode="r")
+        write_quantized(np.asarray(matrix), args.index_path, args.storage)
+    if args.command == "build":
+        build_local_index(args.csv_paths, args.out, metric=args.metric, graph=not args.no_graph, quantized=args.quantize)
+
+
+if __name__ == "__main__":
+    main()
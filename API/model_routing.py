@@ -0,0 +1,179 @@
+"""Per-stage model routing between a small and a large Groq model.
+
+Every stage used to call openai/gpt-oss-120b, including chunk extraction and
+context filtering, which only pick text out of their input. ModelRouter maps
+each pipeline stage to a tier:
+
+    extract     web chunk extraction (aget_interpretations_list)  small
+    summarize   web summary tree reduce                           small
+    refined     retrieval descriptions for reports lab_analysis   small
+                cannot describe locally
+    discard     context filtering (CONTEXT_FILTER=llm)            small
+    final       the interpretation returned to the user           large
+
+Report stages (refined, discard, final) move up to the large tier for
+complex reports: MODEL_ROUTE_ABNORMAL or more abnormal analytes, or a report
+that does not parse as a table (descriptive reports, free text).
+
+MODEL_ROUTES overrides the defaults per stage, with a tier or a model name:
+
+    MODEL_ROUTES="discard=large,summarize=llama-3.1-8b-instant"
+
+Each (stage, model) route records calls, errors, latency and token usage;
+LLM-cache hits are counted apart from calls and left out of latency and
+tokens. /cache/stats reports them under model_routes.
+"""
+import logging
+import os
+import threading
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_groq import ChatGroq
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MODELS = {
+    "small": os.getenv("SMALL_MODEL", "openai/gpt-oss-20b"),
+    "large": os.getenv("LARGE_MODEL", "openai/gpt-oss-120b"),
+}
+STAGE_TIERS = {
+    "extract": "small",
+    "summarize": "small",
+    "refined": "small",
+    "discard": "small",
+    "final": "large",
+}
+# Stages whose prompt contains the report and that escalate for complex reports.
+REPORT_STAGES = ("refined", "discard", "final")
+MODEL_ROUTE_ABNORMAL = int(os.getenv("MODEL_ROUTE_ABNORMAL", "4"))
+# Which of the two Groq keys each stage uses (0 = GROQ_API_KEY, 1 = GROQ_API_KEY_2), as before routing.
+STAGE_KEYS = {"extract": 0, "discard": 0, "summarize": 1, "refined": 1, "final": 1}
+
+
+def parse_routes(text):
+    """'stage=tier_or_model,...' -> {stage: tier_or_model}."""
+    routes = {}
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        stage, _, target = item.partition("=")
+        stage, target = stage.strip(), target.strip()
+        if stage not in STAGE_TIERS or not target:
+            raise ValueError(f"Invalid MODEL_ROUTES entry '{item}', expected <stage>=<small|large|model name> with stage one of {list(STAGE_TIERS)}")
+        routes[stage] = target
+    return routes
+
+
+MODEL_ROUTES = parse_routes(os.getenv("MODEL_ROUTES", ""))
+
+
+class RouteMetrics(BaseCallbackHandler):
+    """Latency and token usage of the LLM calls made through one route.
+
+    A response served from the LLM cache carries no llm_output (Groq always
+    sets one) and was not streamed; it counts as a cache hit, not a call.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = {}
+        self.streamed = set()
+        self.counts = {"calls": 0, "cache_hits": 0, "errors": 0, "latency_s": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.started[run_id] = time.perf_counter()
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        self.streamed.add(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self.started.pop(run_id, None)
+        streamed = run_id in self.streamed
+        self.streamed.discard(run_id)
+        if response.llm_output is None and not streamed:
+            with self.lock:
+                self.counts["cache_hits"] += 1
+            return
+        prompt_tokens, completion_tokens = self.usage(response)
+        with self.lock:
+            self.counts["calls"] += 1
+            self.counts["latency_s"] += time.perf_counter() - (started or time.perf_counter())
+            self.counts["prompt_tokens"] += prompt_tokens
+            self.counts["completion_tokens"] += completion_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.started.pop(run_id, None)
+        self.streamed.discard(run_id)
+        with self.lock:
+            self.counts["errors"] += 1
+
+    @staticmethod
+    def usage(response):
+        """(prompt, completion) tokens; streamed responses carry them on the message if at all."""
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        counts["mean_latency_s"] = round(counts["latency_s"] / counts["calls"], 3) if counts["calls"] else None
+        counts["latency_s"] = round(counts["latency_s"], 3)
+        return counts
+
+
+class ModelRouter:
+    """Hands out the chat client for a stage, and for report stages, for the report's complexity.
+
+    Clients are shared per (model, API key); each (stage, model) route gets
+    its own RouteMetrics callback.
+    """
+
+    def __init__(self, api_keys, cache=None, models=MODELS, routes=MODEL_ROUTES, abnormal_threshold=MODEL_ROUTE_ABNORMAL):
+        self.api_keys = api_keys
+        self.cache = cache
+        self.models = models
+        self.overrides = routes
+        self.routes = {**STAGE_TIERS, **routes}
+        self.abnormal_threshold = abnormal_threshold
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.metrics = {}
+
+    def model(self, stage, analysis=None):
+        target = self.routes[stage]
+        if target == "small" and stage in REPORT_STAGES and stage not in self.overrides and self.is_complex(analysis):
+            target = "large"
+        return self.models.get(target, target)
+
+    def is_complex(self, analysis):
+        if analysis is None:
+            return False
+        return not analysis.is_tabular() or len(analysis.abnormal) >= self.abnormal_threshold
+
+    def client(self, stage, analysis=None):
+        model = self.model(stage, analysis)
+        api_key = self.api_keys[STAGE_KEYS[stage]]
+        with self.lock:
+            if (model, api_key) not in self.clients:
+                self.clients[(model, api_key)] = ChatGroq(api_key=api_key, model_name=model, cache=self.cache)
+            metrics = self.metrics.setdefault((stage, model), RouteMetrics())
+        return self.clients[(model, api_key)].with_config(callbacks=[metrics], tags=[f"stage:{stage}"])
+
+    def signature(self):
+        """The configured model per stage, for cache keys."""
+        return tuple(f"{stage}={self.models.get(target, target)}" for stage, target in sorted(self.routes.items()))
+
+    def stats(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        return {f"{stage}:{model}": route.stats() for (stage, model), route in sorted(metrics.items())}
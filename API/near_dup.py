@@ -0,0 +1,147 @@
+"""MinHash/LSH near-duplicate detection for scraped text.
+
+The pages returned for a test often overlap: hospital sites copy MedlinePlus
+paragraphs, and testing.com repeats its own boilerplate sections. Every
+repeated paragraph is paid for again by the chunk extraction calls.
+NearDuplicateIndex remembers the paragraphs seen so far and flags any new
+one whose word-shingle Jaccard similarity to an earlier one is at least
+``threshold``, using MinHash signatures bucketed by LSH bands so each check
+only compares against a few candidates.
+
+dedupe_documents is the per-request entry point used before chunking. The
+same index works offline on the scrapers' CSV output:
+
+    python near_dup.py testing_scraped_content.csv --column Content --out testing_deduped.csv
+"""
+import argparse
+import csv
+import logging
+import re
+import sys
+import zlib
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+# Paragraphs shorter than this have too few shingles to compare reliably; only exact repeats are dropped.
+MIN_SHINGLE_WORDS = 8
+
+
+def shingles(text, size=5):
+    """CRC32 hashes of the lowercase word ``size``-grams of text."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))}
+    return {zlib.crc32(" ".join(words[i:i + size]).encode("utf-8")) for i in range(len(words) - size + 1)}
+
+
+class NearDuplicateIndex:
+    """Incremental MinHash/LSH index; ``add`` returns False for near-duplicates of earlier texts.
+
+    With 128 permutations in 32 bands of 4 rows, pairs above roughly 0.42
+    Jaccard become candidates; the signature estimate then decides against
+    ``threshold``.
+    """
+
+    def __init__(self, threshold=0.7, num_perm=128, bands=32, shingle_size=5, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = []
+        self.exact = set()
+
+    def signature(self, text):
+        hashes = np.fromiter(shingles(text, self.shingle_size), dtype=np.uint64)
+        # Universal hashing (a*x + b) mod p, minimised over the shingles for every permutation.
+        return ((np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+    def add(self, text):
+        key = re.sub(r"\s+", " ", text.strip().lower())
+        if key in self.exact:
+            return False
+        self.exact.add(key)
+        if len(key.split()) < MIN_SHINGLE_WORDS:
+            return True
+
+        signature = self.signature(text)
+        band_keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+        candidates = set()
+        for bucket, band_key in zip(self.buckets, band_keys):
+            candidates.update(bucket.get(band_key, ()))
+        for candidate in candidates:
+            if np.mean(self.signatures[candidate] == signature) >= self.threshold:
+                return False
+
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        for bucket, band_key in zip(self.buckets, band_keys):
+            bucket.setdefault(band_key, []).append(position)
+        return True
+
+
+def dedupe_documents(documents, tokenizer=None, index=None):
+    """Drop paragraphs (blank-line separated) already seen earlier in this or a previous document.
+
+    Returns the documents with duplicates removed, the number of paragraphs
+    removed and, when a tokenizer is given, how many tokens that saved.
+    """
+    index = index or NearDuplicateIndex()
+    kept_documents = []
+    removed = 0
+    saved_tokens = 0
+    for document in documents:
+        kept = []
+        for paragraph in re.split(r"\n\s*\n", document):
+            if not paragraph.strip():
+                continue
+            if index.add(paragraph):
+                kept.append(paragraph)
+            else:
+                removed += 1
+                if tokenizer is not None:
+                    saved_tokens += len(tokenizer.encode(paragraph))
+        kept_documents.append("\n\n".join(kept))
+    return kept_documents, removed, saved_tokens
+
+
+def dedupe_csv(paths, column, out_path, threshold=0.7):
+    """Keep the first of every group of near-duplicate rows across the scraper CSVs."""
+    csv.field_size_limit(sys.maxsize)
+    index = NearDuplicateIndex(threshold=threshold)
+    kept = dropped = 0
+    writer = None
+    with open(out_path, "w", newline="", encoding="utf-8") as out:
+        for path in paths:
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    if writer is None:
+                        writer = csv.DictWriter(out, fieldnames=list(row), extrasaction="ignore")
+                        writer.writeheader()
+                    if index.add(row.get(column) or ""):
+                        writer.writerow(row)
+                        kept += 1
+                    else:
+                        dropped += 1
+    logging.info(f"Kept {kept} rows, dropped {dropped} near-duplicates, wrote {out_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drop near-duplicate rows from scraped CSV files.")
+    parser.add_argument("csv_paths", nargs="+")
+    parser.add_argument("--column", required=True, help="text column to compare, e.g. Description or Content")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--threshold", type=float, default=0.7)
+    args = parser.parse_args()
+    dedupe_csv(args.csv_paths, args.column, args.out, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
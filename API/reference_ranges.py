@@ -0,0 +1,506 @@
+"""Reference ranges by analyte, unit, sex and age band, with a vectorized evaluator.
+
+/chat used to pass normal_ranges=None, so the LLM had to recall ranges for
+every report. ReferenceRangeTable holds a compact table (BUILTIN_RANGES plus
+ranges mined from the scraped testing.com and MedlinePlus pages) as NumPy
+columns. evaluate_batch converts every measurement of one or many reports to
+the table's unit and picks the most specific matching row for all of them in
+one broadcast, then flags low/high/critical with array comparisons.
+
+normal_ranges_block renders the result as the compact structured block that
+feeds ``normal_ranges`` in the discard and final prompts.
+"""
+import argparse
+import csv
+import logging
+import os
+import re
+import sys
+from collections import defaultdict
+from typing import Optional
+import numpy as np
+from pydantic import BaseModel
+from lab_analysis import CRITICAL_HIGH_FACTOR, CRITICAL_LOW_FACTOR, parse_report
+from test_names import DEFAULT_SOURCES, normalize_test_name
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+REFERENCE_RANGE_SOURCES = [p for p in os.getenv("REFERENCE_RANGE_SOURCES", "").split(",") if p] or DEFAULT_SOURCES
+# Age assumed when the report does not print one.
+DEFAULT_AGE = 30
+ADULT = (18, 200)
+ANY_AGE = (0, 200)
+SEX_CODES = {None: 0, "any": 0, "male": 1, "female": 2}
+# Words that make a name a different measurement than the analyte it contains:
+# "Urine Creatinine", "Cholesterol/HDL Ratio", "Absolute Neutrophil Count", "Direct Bilirubin".
+QUALIFIER_WORDS = {
+    "ratio", "index", "urine", "urinary", "csf", "fluid", "absolute", "abs", "non", "direct", "indirect",
+    "conjugated", "unconjugated", "ionized", "ionised", "clearance", "random", "pp", "postprandial", "prandial", "post",
+}
+
+# analyte: (canonical unit, aliases). Order matters for partial matches: specific analytes come first.
+ANALYTES = {
+    "hdl cholesterol": ("mg/dL", ["hdl", "hdl c", "hdl cholesterol", "high density lipoprotein"]),
+    "ldl cholesterol": ("mg/dL", ["ldl", "ldl c", "ldl cholesterol", "low density lipoprotein"]),
+    "triglycerides": ("mg/dL", ["triglycerides", "triglyceride", "tg"]),
+    "total cholesterol": ("mg/dL", ["total cholesterol", "cholesterol total", "cholesterol", "serum cholesterol"]),
+    "hba1c": ("%", ["hba1c", "a1c", "glycated hemoglobin", "glycosylated hemoglobin", "hemoglobin a1c"]),
+    "mchc": ("g/dL", ["mchc"]),
+    "mch": ("pg", ["mch"]),
+    "mcv": ("fL", ["mcv", "mean corpuscular volume"]),
+    "rdw": ("%", ["rdw", "rdw cv"]),
+    "hemoglobin": ("g/dL", ["hemoglobin", "haemoglobin", "hb", "hgb"]),
+    "hematocrit": ("%", ["hematocrit", "haematocrit", "hct", "pcv", "packed cell volume"]),
+    "rbc": ("10^12/L", ["rbc", "rbc count", "red blood cells", "red blood cell count", "erythrocytes", "total rbc count"]),
+    "wbc": ("10^9/L", ["wbc", "wbc count", "white blood cells", "white blood cell count", "leukocytes", "tlc", "total leucocyte count", "total wbc count"]),
+    "platelets": ("10^9/L", ["platelets", "platelet count", "plt", "thrombocytes"]),
+    "neutrophils": ("%", ["neutrophils", "neutrophil"]),
+    "lymphocytes": ("%", ["lymphocytes", "lymphocyte"]),
+    "glucose": ("mg/dL", ["glucose", "fasting glucose", "fasting blood sugar", "fbs", "blood sugar", "fasting plasma glucose"]),
+    "creatinine": ("mg/dL", ["creatinine", "serum creatinine"]),
+    "bun": ("mg/dL", ["bun", "blood urea nitrogen", "urea nitrogen"]),
+    "egfr": ("mL/min/1.73m2", ["egfr", "gfr", "estimated gfr"]),
+    "tsh": ("mIU/L", ["tsh", "thyroid stimulating hormone"]),
+    "free t4": ("ng/dL", ["free t4", "ft4", "free thyroxine"]),
+    "free t3": ("pg/mL", ["free t3", "ft3", "free triiodothyronine"]),
+    "sodium": ("mmol/L", ["sodium", "na"]),
+    "potassium": ("mmol/L", ["potassium", "k"]),
+    "chloride": ("mmol/L", ["chloride", "cl"]),
+    "calcium": ("mg/dL", ["calcium", "ca", "serum calcium"]),
+    "alt": ("U/L", ["alt", "sgpt", "alanine aminotransferase"]),
+    "ast": ("U/L", ["ast", "sgot", "aspartate aminotransferase"]),
+    "alp": ("U/L", ["alp", "alkaline phosphatase"]),
+    "bilirubin": ("mg/dL", ["bilirubin", "total bilirubin", "bilirubin total"]),
+    "albumin": ("g/dL", ["albumin", "serum albumin"]),
+    "ferritin": ("ng/mL", ["ferritin", "serum ferritin"]),
+    "vitamin d": ("ng/mL", ["vitamin d", "25 oh vitamin d", "vitamin d 25 hydroxy", "25 hydroxy vitamin d"]),
+    "esr": ("mm/hr", ["esr", "erythrocyte sedimentation rate"]),
+    "uric acid": ("mg/dL", ["uric acid", "serum uric acid"]),
+}
+
+# Factors that hold for every analyte with a given canonical unit: (normalized canonical unit, normalized unit) -> factor.
+# Keyed on the canonical unit so a unit of another dimension ("10^3/uL" for a "%" analyte) never converts.
+CANONICAL_UNIT_FACTORS = {
+    ("g/dl", "g/l"): 0.1,
+    ("u/l", "iu/l"): 1.0,
+    ("mmol/l", "meq/l"): 1.0,
+    ("10^9/l", "10^3/ul"): 1.0,
+    ("10^9/l", "/ul"): 0.001,
+    ("10^9/l", "cells/ul"): 0.001,
+    ("ng/ml", "ug/l"): 1.0,
+    ("miu/l", "uiu/ml"): 1.0,
+}
+
+# (analyte, normalized unit) -> factor to the canonical unit.
+UNIT_FACTORS = {
+    ("hemoglobin", "mmol/l"): 1.611,
+    ("hematocrit", "l/l"): 100.0,
+    ("rbc", "10^6/ul"): 1.0,
+    ("rbc", "million/ul"): 1.0,
+    ("platelets", "lakh/ul"): 100.0,
+    ("glucose", "mmol/l"): 18.016,
+    ("total cholesterol", "mmol/l"): 38.67,
+    ("ldl cholesterol", "mmol/l"): 38.67,
+    ("hdl cholesterol", "mmol/l"): 38.67,
+    ("triglycerides", "mmol/l"): 88.57,
+    ("creatinine", "umol/l"): 1 / 88.42,
+    ("bun", "mmol/l"): 2.801,
+    ("calcium", "mmol/l"): 4.008,
+    ("bilirubin", "umol/l"): 1 / 17.1,
+    ("free t4", "pmol/l"): 1 / 12.87,
+    ("free t3", "pmol/l"): 0.651,
+    ("vitamin d", "nmol/l"): 1 / 2.496,
+    ("hba1c", "mmol/mol"): None,  # IFCC units are not a linear rescale; leave unconverted.
+}
+
+# (analyte, sex, (age_min, age_max), low, high, critical_low, critical_high); None means no limit.
+# Typical adult ranges; a report's own printed range still takes precedence for its flag.
+BUILTIN_RANGES = [
+    ("hemoglobin", "any", ADULT, 12.0, 17.5, 7.0, 20.0),
+    ("hemoglobin", "male", ADULT, 13.5, 17.5, 7.0, 20.0),
+    ("hemoglobin", "female", ADULT, 12.0, 15.5, 7.0, 20.0),
+    ("hemoglobin", "any", (1, 18), 11.0, 14.5, 7.0, 20.0),
+    ("hematocrit", "any", ADULT, 36.0, 53.0, 20.0, 60.0),
+    ("hematocrit", "male", ADULT, 41.0, 53.0, 20.0, 60.0),
+    ("hematocrit", "female", ADULT, 36.0, 46.0, 20.0, 60.0),
+    ("rbc", "any", ADULT, 4.1, 5.9, None, None),
+    ("rbc", "male", ADULT, 4.5, 5.9, None, None),
+    ("rbc", "female", ADULT, 4.1, 5.1, None, None),
+    ("wbc", "any", ANY_AGE, 4.5, 11.0, 2.0, 30.0),
+    ("platelets", "any", ANY_AGE, 150.0, 450.0, 20.0, 1000.0),
+    ("mcv", "any", ADULT, 80.0, 100.0, None, None),
+    ("mch", "any", ADULT, 27.0, 33.0, None, None),
+    ("mchc", "any", ADULT, 32.0, 36.0, None, None),
+    ("rdw", "any", ADULT, 11.5, 14.5, None, None),
+    ("neutrophils", "any", ADULT, 40.0, 70.0, None, None),
+    ("lymphocytes", "any", ADULT, 20.0, 40.0, None, None),
+    ("glucose", "any", ANY_AGE, 70.0, 99.0, 40.0, 400.0),
+    ("hba1c", "any", ANY_AGE, 4.0, 5.6, None, None),
+    ("total cholesterol", "any", ADULT, None, 200.0, None, None),
+    ("ldl cholesterol", "any", ADULT, None, 100.0, None, None),
+    ("hdl cholesterol", "any", ADULT, 40.0, None, None, None),
+    ("hdl cholesterol", "male", ADULT, 40.0, None, None, None),
+    ("hdl cholesterol", "female", ADULT, 50.0, None, None, None),
+    ("triglycerides", "any", ADULT, None, 150.0, None, 1000.0),
+    ("creatinine", "any", ADULT, 0.59, 1.35, None, 10.0),
+    ("creatinine", "male", ADULT, 0.74, 1.35, None, 10.0),
+    ("creatinine", "female", ADULT, 0.59, 1.04, None, 10.0),
+    ("bun", "any", ADULT, 6.0, 24.0, None, 100.0),
+    ("egfr", "any", ADULT, 60.0, None, 15.0, None),
+    ("tsh", "any", ADULT, 0.4, 4.0, None, None),
+    ("free t4", "any", ADULT, 0.8, 1.8, None, None),
+    ("free t3", "any", ADULT, 2.3, 4.2, None, None),
+    ("sodium", "any", ANY_AGE, 135.0, 145.0, 120.0, 160.0),
+    ("potassium", "any", ANY_AGE, 3.5, 5.1, 2.5, 6.5),
+    ("chloride", "any", ANY_AGE, 98.0, 107.0, None, None),
+    ("calcium", "any", ADULT, 8.6, 10.3, 6.0, 13.0),
+    ("alt", "any", ADULT, 7.0, 56.0, None, None),
+    ("ast", "any", ADULT, 10.0, 40.0, None, None),
+    ("alp", "any", ADULT, 44.0, 147.0, None, None),
+    ("bilirubin", "any", ADULT, 0.1, 1.2, None, 15.0),
+    ("albumin", "any", ADULT, 3.4, 5.4, None, None),
+    ("ferritin", "any", ADULT, 11.0, 336.0, None, None),
+    ("ferritin", "male", ADULT, 24.0, 336.0, None, None),
+    ("ferritin", "female", ADULT, 11.0, 307.0, None, None),
+    ("vitamin d", "any", ADULT, 20.0, 50.0, None, None),
+    ("esr", "any", ADULT, 0.0, 20.0, None, None),
+    ("esr", "male", ADULT, 0.0, 15.0, None, None),
+    ("esr", "female", ADULT, 0.0, 20.0, None, None),
+    ("uric acid", "any", ADULT, 2.4, 7.0, None, None),
+    ("uric acid", "male", ADULT, 3.4, 7.0, None, None),
+    ("uric acid", "female", ADULT, 2.4, 6.0, None, None),
+]
+
+
+class RangeCheck(BaseModel):
+    name: str
+    analyte: Optional[str] = None
+    value: Optional[float] = None
+    unit: str = ""
+    low: Optional[float] = None
+    high: Optional[float] = None
+    population: str = ""
+    flag: str = "unknown"
+    # The report printed its own range for this entry.
+    printed_range: bool = False
+
+
+def normalize_unit(unit):
+    unit = (unit or "").lower().replace(" ", "").replace("µ", "u").replace("μ", "u")
+    unit = re.sub(r"^x", "", unit)
+    unit = unit.replace("*", "^").replace("mcl", "ul").replace("cumm", "ul").replace("mm3", "ul").replace("cu.mm", "ul")
+    unit = re.sub(r"^10(\d+)", r"10^\1", unit)
+    return unit.replace("mill/", "million/").replace("lakhs/", "lakh/")
+
+
+def unit_factor(analyte, unit):
+    """Factor that converts a value in ``unit`` to the analyte's canonical unit; None if unknown.
+
+    A missing unit is unknown too: "WBC 7500" is cells/uL, not 7500 x 10^9/L.
+    """
+    if not unit:
+        return None
+    normalized = normalize_unit(unit)
+    canonical = normalize_unit(ANALYTES[analyte][0])
+    if normalized == canonical:
+        return 1.0
+    if (analyte, normalized) in UNIT_FACTORS:
+        return UNIT_FACTORS[(analyte, normalized)]
+    return CANONICAL_UNIT_FACTORS.get((canonical, normalized))
+
+
+def _fmt(value):
+    return f"{value:g}"
+
+
+def _limits(low, high):
+    if low is None:
+        return f"< {_fmt(high)}"
+    if high is None:
+        return f"> {_fmt(low)}"
+    return f"{_fmt(low)}-{_fmt(high)}"
+
+
+class ReferenceRangeTable:
+    def __init__(self, rows=BUILTIN_RANGES):
+        self.analyte_ids = {analyte: i for i, analyte in enumerate(ANALYTES)}
+        self.aliases = {}
+        for analyte, (_, aliases) in ANALYTES.items():
+            for alias in [analyte] + aliases:
+                self.aliases.setdefault(normalize_test_name(alias), analyte)
+        # Word -> (alias words, order, analyte) for the aliases a longer name may contain.
+        # Short aliases ("k", "na", "hb") only match as the whole name.
+        self.word_aliases = defaultdict(list)
+        for order, (alias, analyte) in enumerate(self.aliases.items()):
+            if len(alias) > 3:
+                words = frozenset(alias.split())
+                for word in words:
+                    self.word_aliases[word].append((words, order, analyte))
+        # Aliases of 3+ characters as whole words, longest first, for mining free text.
+        self.alias_pattern = re.compile(
+            r"\b(" + "|".join(re.escape(a) for a in sorted((a for a in self.aliases if len(a) >= 3), key=len, reverse=True)) + r")\b"
+        )
+        self.rows = []
+        self.set_rows(rows)
+
+    def set_rows(self, rows):
+        self.rows = list(rows)
+        as_float = lambda v: np.nan if v is None else float(v)  # noqa: E731
+        self.row_analyte = np.array([self.analyte_ids[r[0]] for r in self.rows], dtype=np.int32)
+        self.row_sex = np.array([SEX_CODES[r[1]] for r in self.rows], dtype=np.int8)
+        self.row_age_min = np.array([r[2][0] for r in self.rows], dtype=np.float32)
+        self.row_age_max = np.array([r[2][1] for r in self.rows], dtype=np.float32)
+        self.row_low, self.row_high, self.row_crit_low, self.row_crit_high = (
+            np.array([as_float(r[i]) for r in self.rows], dtype=np.float64) for i in (3, 4, 5, 6)
+        )
+        # More specific rows win: a sex-specific row over "any", a narrow age band over a wide one.
+        self.row_specificity = (self.row_sex != 0) * 2 + ((self.row_age_max - self.row_age_min) < 100)
+
+    def covers(self, analyte, band):
+        """True when a row for ``analyte`` already applies to some age in ``band``, for any sex."""
+        return any(r[0] == analyte and r[2][0] < band[1] and band[0] < r[2][1] for r in self.rows)
+
+    def add_rows(self, rows):
+        """Add rows for (analyte, age band) combinations the table does not cover yet.
+
+        Rows already in the table (BUILTIN_RANGES first) always win: a mined
+        "men 150-199" row never sits next to a curated "any" row, where its
+        sex would make it the more specific match.
+        """
+        new = []
+        for row in rows:
+            if not self.covers(row[0], row[2]) and not any(n[0] == row[0] and n[1] == row[1] and n[2] == row[2] for n in new):
+                new.append(row)
+        self.set_rows(self.rows + new)
+        return len(new)
+
+    def analyte(self, name):
+        """Canonical analyte for a printed name ('Haemoglobin (Hb)' -> 'hemoglobin'), or None.
+
+        Names are matched on a whole alias, or, when they carry no
+        qualifier, on the longest alias whose words they contain ("Serum
+        Potassium"). "SGPT/ALT" matches when every part names the same analyte.
+        """
+        key = normalize_test_name(name)
+        if key in self.aliases:
+            return self.aliases[key]
+        stripped = re.sub(r"\([^)]*\)", " ", name or "")
+        key = normalize_test_name(stripped)
+        if key in self.aliases:
+            return self.aliases[key]
+        if "/" in stripped:
+            parts = {self.aliases.get(normalize_test_name(part)) for part in stripped.split("/")}
+            return parts.pop() if len(parts) == 1 else None
+        words = set(key.split())
+        if words & QUALIFIER_WORDS:
+            return None
+        best, best_rank = None, None
+        for word in words:
+            for alias_words, order, analyte in self.word_aliases.get(word, ()):
+                rank = (len(alias_words), -order)
+                if alias_words <= words and (best_rank is None or rank > best_rank):
+                    best, best_rank = analyte, rank
+        return best
+
+    def evaluate_batch(self, reports):
+        """Check every measurement of many reports at once.
+
+        ``reports`` is a list of ReportAnalysis; returns one list of
+        RangeCheck per report, in measurement order.
+        """
+        names, analyte_ids, values, sexes, ages, owners = [], [], [], [], [], []
+        for owner, analysis in enumerate(reports):
+            sex = SEX_CODES.get(analysis.sex, 0)
+            age = analysis.age if analysis.age is not None else DEFAULT_AGE
+            for m in analysis.measurements:
+                analyte = self.analyte(m.name)
+                factor = unit_factor(analyte, m.unit) if analyte else None
+                names.append((m.name, analyte, bool(m.reference)))
+                analyte_ids.append(self.analyte_ids[analyte] if analyte else -1)
+                values.append(m.value * factor if factor is not None and m.value is not None else np.nan)
+                sexes.append(sex)
+                ages.append(age)
+                owners.append(owner)
+        results = [[] for _ in reports]
+        if not names:
+            return results
+
+        q_analyte = np.array(analyte_ids, dtype=np.int32)[:, None]
+        q_sex = np.array(sexes, dtype=np.int8)[:, None]
+        q_age = np.array(ages, dtype=np.float32)[:, None]
+        match = (
+            (self.row_analyte[None, :] == q_analyte)
+            & ((self.row_sex[None, :] == 0) | (self.row_sex[None, :] == q_sex))
+            & (self.row_age_min[None, :] <= q_age)
+            & (q_age < self.row_age_max[None, :])
+        )
+        scores = np.where(match, self.row_specificity[None, :], -1)
+        best = scores.argmax(axis=1)
+        found = scores.max(axis=1) >= 0
+
+        value = np.array(values, dtype=np.float64)
+        low = np.where(found, self.row_low[best], np.nan)
+        high = np.where(found, self.row_high[best], np.nan)
+        crit_low = np.where(np.isnan(self.row_crit_low[best]), low * CRITICAL_LOW_FACTOR, self.row_crit_low[best])
+        crit_high = np.where(np.isnan(self.row_crit_high[best]), high * CRITICAL_HIGH_FACTOR, self.row_crit_high[best])
+        # NaN comparisons are False, so a missing limit never flags.
+        flags = np.select(
+            [~found | np.isnan(value), value < crit_low, value > crit_high, value < low, value > high],
+            ["unknown", "critical-low", "critical-high", "low", "high"],
+            default="normal",
+        )
+
+        for i, (name, analyte, printed_range) in enumerate(names):
+            row = self.rows[best[i]] if found[i] else None
+            population = ""
+            if row is not None:
+                band = "adult" if row[2] == ADULT else ("any age" if row[2] == ANY_AGE else f"age {row[2][0]}-{row[2][1]}")
+                population = band if row[1] == "any" else f"{row[1]}, {band}"
+            results[owners[i]].append(RangeCheck(
+                name=name,
+                analyte=analyte,
+                value=None if np.isnan(value[i]) else float(value[i]),
+                unit=ANALYTES[analyte][0] if analyte else "",
+                low=None if np.isnan(low[i]) else float(low[i]),
+                high=None if np.isnan(high[i]) else float(high[i]),
+                population=population,
+                flag=str(flags[i]),
+                printed_range=printed_range,
+            ))
+        return results
+
+    def evaluate(self, analysis):
+        return self.evaluate_batch([analysis])[0]
+
+
+def apply_reference_ranges(analysis, checks):
+    """Flag measurements the report gave no flag or range for from the table.
+
+    A flag computed from the report's own range or printed next to the value
+    is never changed; the table only fills the gaps. Only the flag changes:
+    the table's limits are in the canonical unit, not necessarily the
+    report's, and reach the prompts through normal_ranges_block.
+    """
+    for measurement, check in zip(analysis.measurements, checks):
+        if check.flag != "unknown" and measurement.flag == "unknown" and not measurement.reference:
+            measurement.flag = check.flag
+    return analysis
+
+
+def normal_ranges_block(checks):
+    """Compact 'name: low-high unit (population)' lines, or None.
+
+    Entries whose range the report already prints are left out; the
+    prompts tell the model to prefer the report's own ranges anyway.
+    """
+    lines = [
+        f"{check.name}: {_limits(check.low, check.high)} {check.unit} ({check.population})"
+        for check in checks
+        if not check.printed_range and (check.low is not None or check.high is not None)
+    ]
+    return "\n".join(lines) or None
+
+
+def analyze_reports(reports):
+    """Parse and range-check a batch of report strings; returns (analysis, checks) per report."""
+    analyses = [parse_report(report) for report in reports]
+    checks = reference_table.evaluate_batch(analyses)
+    return [(apply_reference_ranges(analysis, c), c) for analysis, c in zip(analyses, checks)]
+
+
+def analyze_report(report):
+    return analyze_reports([report])[0]
+
+
+# Mined ranges must be stated as the normal range, not as a category band ("borderline high is 150 to 199").
+REFERENCE_WORDING = re.compile(r"\b(normal|reference|healthy|typical)\b")
+CATEGORY_WORDING = re.compile(r"\b(borderline|risk|deficien\w*|insufficien\w*|toxic|diabetes|prediabetes|elevated|severe|moderate|mild)\b")
+RANGE_SENTENCE = re.compile(r"\b(\d+(?:\.\d+)?)\s*(?:-|–|to)\s*(\d+(?:\.\d+)?)\s*([a-zA-Zµμ%/^][a-zA-Zµμ%/^0-9.]*[a-zA-Zµμ%0-9]|%)")
+
+
+def nearest_analyte(lowered, position, table):
+    """The analyte whose alias ends closest before ``position`` in the sentence, else the first one after it."""
+    before, after = None, None
+    for alias in table.alias_pattern.finditer(lowered):
+        if alias.end() <= position:
+            before = alias.group(1)
+        elif after is None:
+            after = alias.group(1)
+    alias = before or after
+    return table.aliases[alias] if alias else None
+
+
+def mine_reference_ranges(texts, table):
+    """Collect 'X to Y unit' normal ranges stated next to an analyte name in scraped pages.
+
+    Only sentences that call the range normal or reference are used, and a
+    range belongs to the analyte named closest before it (or after it, when
+    none precedes it). Sentences mentioning men/women or children are
+    attributed to that sex or age band; values are converted to the
+    canonical unit and the median across pages is kept per (analyte, sex, band).
+    """
+    found = defaultdict(list)
+    for text in texts:
+        for sentence in re.split(r"(?<=[.!?])\s+", text or ""):
+            match = RANGE_SENTENCE.search(sentence)
+            if not match:
+                continue
+            lowered = sentence.lower()
+            if not REFERENCE_WORDING.search(lowered) or CATEGORY_WORDING.search(lowered):
+                continue
+            analyte = nearest_analyte(lowered, match.start(), table)
+            if analyte is None:
+                continue
+            factor = unit_factor(analyte, match.group(3))
+            if factor is None:
+                continue
+            sex = "female" if re.search(r"\b(women|female|females)\b", lowered) else "male" if re.search(r"\b(men|male|males)\b", lowered) else "any"
+            band = (1, 18) if re.search(r"\b(child|children|kids)\b", lowered) else ADULT
+            if re.search(r"\b(newborn|infant|babies|pregnan)", lowered):
+                continue
+            low, high = float(match.group(1)) * factor, float(match.group(2)) * factor
+            if low < high:
+                found[(analyte, sex, band)].append((low, high))
+    rows = []
+    for (analyte, sex, band), pairs in found.items():
+        lows, highs = zip(*pairs)
+        rows.append((analyte, sex, band, round(float(np.median(lows)), 3), round(float(np.median(highs)), 3), None, None))
+    return rows
+
+
+def read_scraped_texts(path, columns=("Description", "Content", "text")):
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            yield next((row[c] for c in columns if row.get(c)), "")
+
+
+def load_reference_table(sources=REFERENCE_RANGE_SOURCES):
+    table = ReferenceRangeTable()
+    for path in sources:
+        if not os.path.exists(path):
+            continue
+        try:
+            added = table.add_rows(mine_reference_ranges(read_scraped_texts(path), table))
+        except (OSError, csv.Error) as e:
+            logging.error(f"Error mining reference ranges from {path}: {e}")
+            continue
+        logging.info(f"Added {added} mined reference ranges from {path}")
+    return table
+
+
+reference_table = load_reference_table()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the reference ranges mined from scraped pages.")
+    parser.add_argument("csv_paths", nargs="*", default=REFERENCE_RANGE_SOURCES)
+    args = parser.parse_args()
+    table = ReferenceRangeTable(rows=[])
+    for path in args.csv_paths:
+        for row in mine_reference_ranges(read_scraped_texts(path), table):
+            print(path, row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Local alternative to the adiscard_irrelevant_context LLM call.
+
+The discard stage only has to pick which retrieved and web paragraphs are
+relevant to the report, and it costs a full sequential Groq round trip
+before the final answer can start. With CONTEXT_FILTER set to
+``embedding`` or ``cross-encoder`` the paragraphs are instead scored on CPU
+against the test name and report, and the best ones are kept up to
+RERANK_TOKEN_BUDGET tokens. ``llm`` (the default) keeps the original call.
+
+    embedding       reuses the query encoder (cosine to the report)
+    cross-encoder   sentence-transformers CrossEncoder, RERANK_MODEL
+
+Test_Files/eval_context_filter.py compares the two paths end to end.
+
+ChunkGate applies the same idea earlier, to the web chunks that
+aget_interpretations_list would otherwise send to the LLM one by one.
+"""
+import logging
+import os
+import random
+import re
+import threading
+import numpy as np
+from functions import encode_texts, is_unhelpful
+from retrieval import default_tokenizer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# llm | embedding | cross-encoder
+CONTEXT_FILTER = os.getenv("CONTEXT_FILTER", "llm")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_TOKEN_BUDGET = int(os.getenv("RERANK_TOKEN_BUDGET", "1200"))
+# off | on; tune CHUNK_GATE_THRESHOLD from the logged skip rate and recall before enabling.
+CHUNK_GATE = os.getenv("CHUNK_GATE", "off")
+CHUNK_GATE_THRESHOLD = float(os.getenv("CHUNK_GATE_THRESHOLD", "0.35"))
+# Fraction of skipped chunks still sent to the LLM to estimate how many helpful ones the gate drops.
+CHUNK_GATE_AUDIT_RATE = float(os.getenv("CHUNK_GATE_AUDIT_RATE", "0.1"))
+INTENT_QUERIES = [
+    "{test_name}",
+    "How to interpret {test_name} test results",
+    "{test_name} normal range and reference values",
+    "What high or low {test_name} levels mean",
+    "Causes of abnormal {test_name} results",
+]
+# The encoder truncates at 512 word pieces, so long chunks are scored window by window.
+GATE_WINDOW_WORDS = 200
+# Headings and stray fragments carry nothing for the final prompt.
+MIN_PARAGRAPH_WORDS = 5
+
+
+def split_paragraphs(*texts):
+    """Split the bullet list from select_context and the web summary into paragraphs."""
+    paragraphs = []
+    for text in texts:
+        if not text:
+            continue
+        text = re.sub(r"<[^>]+>", " ", text)
+        for block in re.split(r"\n\s*\n", text):
+            lines = [line.strip() for line in block.splitlines() if line.strip()]
+            if lines and all(line.startswith(("- ", "* ")) for line in lines):
+                candidates = [line[2:] for line in lines]
+            else:
+                candidates = [" ".join(lines)]
+            paragraphs.extend(p.strip() for p in candidates if len(p.split()) >= MIN_PARAGRAPH_WORDS)
+    return list(dict.fromkeys(paragraphs))
+
+
+def relevance_query(test_name, report):
+    return f"{test_name}: {report}"
+
+
+class EmbeddingReranker:
+    """Scores paragraphs by cosine similarity to the report with the query encoder."""
+
+    def __init__(self, embedding_model):
+        self.embedding_model = embedding_model
+
+    def score(self, query, paragraphs):
+        # Corpus chunks recur across requests, so the embedding cache absorbs most of this.
+        vectors = np.asarray(encode_texts([query] + paragraphs, self.embedding_model), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[1:] @ vectors[0]
+
+
+class CrossEncoderReranker:
+    """Scores (report, paragraph) pairs with a small CPU cross-encoder."""
+
+    def __init__(self, model_name=RERANK_MODEL):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query, paragraphs):
+        return np.asarray(self.model.predict([(query, p) for p in paragraphs]), dtype=np.float32)
+
+
+def create_reranker(embedding_model, kind=CONTEXT_FILTER):
+    """Return the configured reranker, or None to keep the LLM discard call."""
+    if kind == "llm":
+        return None
+    if kind == "embedding":
+        return EmbeddingReranker(embedding_model)
+    if kind == "cross-encoder":
+        return CrossEncoderReranker()
+    raise ValueError(f"Unknown CONTEXT_FILTER '{kind}', expected llm, embedding or cross-encoder")
+
+
+def rerank_context(test_name, report, retrieved_context, web_content, reranker, tokenizer=None, token_budget=RERANK_TOKEN_BUDGET):
+    """Keep the paragraphs most relevant to the report, best first, within token_budget."""
+    tokenizer = tokenizer or default_tokenizer()
+    paragraphs = split_paragraphs(retrieved_context, web_content)
+    if not paragraphs:
+        return ""
+    scores = reranker.score(relevance_query(test_name, report), paragraphs)
+    kept = []
+    used = 0
+    for i in np.argsort(-scores):
+        tokens = len(tokenizer.encode(paragraphs[i]))
+        if used + tokens > token_budget:
+            continue
+        kept.append(paragraphs[i])
+        used += tokens
+    logging.info(f"Reranker kept {len(kept)} of {len(paragraphs)} paragraphs ({used} tokens)")
+    return "\n\n".join(kept)
+
+
+class ChunkGate:
+    """Skips web chunks that look unrelated to the test before the LLM extraction call.
+
+    A chunk's score is its best cosine similarity, over its word windows,
+    to the test name and the INTENT_QUERIES. At least ``min_keep`` chunks
+    always go through. A random ``audit_rate`` share of the skipped chunks
+    is sent anyway; how often those come back helpful estimates the recall
+    of the gate.
+    """
+
+    def __init__(self, embedding_model, threshold=CHUNK_GATE_THRESHOLD, audit_rate=CHUNK_GATE_AUDIT_RATE, min_keep=1):
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.min_keep = min_keep
+        self.lock = threading.Lock()
+        self.counts = {"chunks": 0, "skipped": 0, "audited": 0, "audited_helpful": 0, "kept_helpful": 0}
+
+    def score(self, test_name, chunks):
+        queries = [query.format(test_name=test_name) for query in INTENT_QUERIES]
+        windows, owners = [], []
+        for i, chunk in enumerate(chunks):
+            words = chunk.split()
+            for start in range(0, max(len(words), 1), GATE_WINDOW_WORDS):
+                windows.append(" ".join(words[start:start + GATE_WINDOW_WORDS]))
+                owners.append(i)
+        vectors = np.asarray(encode_texts(queries + windows, self.embedding_model), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        window_scores = (vectors[len(queries):] @ vectors[:len(queries)].T).max(axis=1)
+        scores = np.full(len(chunks), -1.0, dtype=np.float32)
+        np.maximum.at(scores, np.asarray(owners), window_scores)
+        return scores
+
+    def select(self, test_name, chunks):
+        """Return one decision per chunk: "keep", "audit" (skipped but sent) or "skip"."""
+        if not chunks:
+            return []
+        scores = self.score(test_name, chunks)
+        keep = scores >= self.threshold
+        keep[np.argsort(-scores)[:self.min_keep]] = True
+        decisions = ["keep" if k else ("audit" if random.random() < self.audit_rate else "skip") for k in keep]
+        with self.lock:
+            self.counts["chunks"] += len(chunks)
+            self.counts["skipped"] += decisions.count("skip") + decisions.count("audit")
+        logging.info(
+            f"Chunk gate for {test_name}: kept {int(keep.sum())}/{len(chunks)}, "
+            f"scores {', '.join(f'{score:.2f}' for score in scores)}"
+        )
+        return decisions
+
+    def record(self, test_name, decisions, responses):
+        """Count helpful responses for the chunks that were sent (None for failed calls)."""
+        with self.lock:
+            for decision, response in zip(decisions, responses):
+                if response is None:
+                    continue
+                helpful = not is_unhelpful(response)
+                if decision == "keep":
+                    self.counts["kept_helpful"] += helpful
+                else:
+                    self.counts["audited"] += 1
+                    self.counts["audited_helpful"] += helpful
+            stats = self.stats()
+        logging.info(f"Chunk gate totals after {test_name}: skip rate {stats['skip_rate']:.2f}, estimated recall {stats['estimated_recall']}")
+
+    def stats(self):
+        counts = dict(self.counts)
+        counts["skip_rate"] = counts["skipped"] / counts["chunks"] if counts["chunks"] else 0.0
+        # Helpful chunks among all skipped ones, extrapolated from the audited sample.
+        missed = counts["audited_helpful"] / counts["audited"] * counts["skipped"] if counts["audited"] else None
+        found = counts["kept_helpful"]
+        counts["estimated_recall"] = None if missed is None or found + missed == 0 else round(found / (found + missed), 3)
+        return counts
+
+
+def create_chunk_gate(embedding_model, enabled=CHUNK_GATE):
+    return ChunkGate(embedding_model) if enabled == "on" else None
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+# A hit only rewrites last_access when the stored one is older than this; LRU order does not need more precision.
+LAST_ACCESS_RESOLUTION = 60.0
+
+
+def _normalize_text(text):
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+
+def _normalize_value(value):
+    if isinstance(value, dict):
+        return {_normalize_text(k): _normalize_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize_value(v) for v in value]
+    if isinstance(value, str):
+        return _normalize_text(value)
+    return value
+
+
+def normalize_report(report):
+    """Canonical form of a report so that formatting-only differences share a key.
+
+    JSON reports (what /extract-lab-report returns) are re-serialised with
+    sorted keys, collapsed whitespace and lower-cased strings; anything that
+    is not JSON falls back to whitespace/case folding of the raw text.
+    """
+    try:
+        parsed = json.loads(report)
+    except (TypeError, ValueError):
+        return _normalize_text(report)
+    return json.dumps(_normalize_value(parsed), sort_keys=True, separators=(",", ":"))
+
+
+def cache_key(test_name, report, disease, model_names):
+    payload = json.dumps(
+        [_normalize_text(test_name), normalize_report(report), _normalize_text(disease), list(model_names)],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, now):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteBackend:
+    """Persistent LRU + TTL store, shared by every worker pointing at the same file."""
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self.connection.commit()
+
+    def get(self, key, now):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires_at, last_access FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at, last_access = row
+            if expires_at <= now:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                return None
+            if now - last_access > LAST_ACCESS_RESOLUTION:
+                self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self.connection.commit()
+            return value
+
+    def set(self, key, value, expires_at):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            self.connection.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            self.connection.execute(
+                """DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+            self.connection.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.backend.get(key, time.time())
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, time.time() + self.ttl)
+
+    # The async handlers use these: SQLite reads, writes and commits would otherwise block the event loop.
+    async def aget(self, key):
+        if isinstance(self.backend, MemoryBackend):
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key, value):
+        if isinstance(self.backend, MemoryBackend):
+            return self.set(key, value)
+        await asyncio.to_thread(self.set, key, value)
+
+    async def astats(self):
+        return await asyncio.to_thread(self.stats)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_response_cache(backend=RESPONSE_CACHE_BACKEND):
+    if backend == "sqlite":
+        return ResponseCache(SQLiteBackend())
+    if backend != "memory":
+        logging.warning(f"Unknown RESPONSE_CACHE_BACKEND '{backend}', using memory")
+    return ResponseCache(MemoryBackend())
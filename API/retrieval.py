@@ -0,0 +1,124 @@
+"""Post-processing of vector index matches into the context sent to the LLM.
+
+Both generated descriptions retrieve top_k chunks each, and the corpus has
+many near-identical chunks (the same MedlinePlus paragraph scraped under
+several tests, overlapping book windows). select_context replaces the old
+substring check with:
+
+1. exact dedup on a hash of the whitespace/case-normalised text, keeping the
+   best score a chunk got from any description;
+2. near-duplicate removal on the match vectors (cosine >= NEAR_DUP_THRESHOLD
+   to an already selected chunk);
+3. MMR (maximal marginal relevance) over the pooled candidates, so the
+   second description contributes chunks that add something;
+4. a token budget, so the discard prompt gets fewer, better tokens.
+"""
+import hashlib
+import logging
+import os
+import re
+import numpy as np
+import tiktoken
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "2000"))
+# 1.0 ranks purely by relevance, lower values trade relevance for diversity.
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.95"))
+
+_tokenizer = None
+
+
+def default_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = tiktoken.get_encoding("cl100k_base")
+    return _tokenizer
+
+
+def uses_match_vectors(lambda_=MMR_LAMBDA, near_dup=NEAR_DUP_THRESHOLD):
+    """Whether select_context needs the match vectors.
+
+    With MMR_LAMBDA=1 and NEAR_DUP_THRESHOLD>=1 selection is pure relevance
+    order, so the index need not return a 768-dim vector per match.
+    """
+    return lambda_ < 1.0 or near_dup < 1.0
+
+
+def text_hash(text):
+    return hashlib.sha1(re.sub(r"\s+", " ", text).strip().lower().encode("utf-8")).hexdigest()
+
+
+def _values(match):
+    try:
+        values = match["values"]
+    except (KeyError, AttributeError):
+        return None
+    return values or None
+
+
+def pool_matches(results):
+    """Flatten the per-description results into unique candidates.
+
+    Returns (texts, scores, vectors); vectors is None unless every
+    candidate came back with its values.
+    """
+    best = {}
+    for search_result in results:
+        for match in search_result["matches"]:
+            text = match["metadata"]["text"]
+            if not text or not text.strip():
+                continue
+            key = text_hash(text)
+            score = float(match["score"])
+            if key not in best or score > best[key][1]:
+                best[key] = (text, score, _values(match))
+    candidates = list(best.values())
+    texts = [text for text, _, _ in candidates]
+    scores = np.array([score for _, score, _ in candidates], dtype=np.float32)
+    vectors = None
+    if candidates and all(values is not None for _, _, values in candidates):
+        vectors = np.asarray([values for _, _, values in candidates], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return texts, scores, vectors
+
+
+def mmr_order(scores, vectors, lambda_=MMR_LAMBDA, near_dup=NEAR_DUP_THRESHOLD):
+    """Yield candidate indices in MMR order, skipping near-duplicates."""
+    if vectors is None:
+        yield from np.argsort(-scores)
+        return
+    # Min-max scale relevance so it is comparable to cosine similarity whatever the index metric.
+    spread = float(scores.max() - scores.min())
+    relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+    similarity = vectors @ vectors.T
+    redundancy = np.zeros(len(scores), dtype=np.float32)
+    available = np.ones(len(scores), dtype=bool)
+    while available.any():
+        mmr = np.where(available, lambda_ * relevance - (1 - lambda_) * redundancy, -np.inf)
+        chosen = int(np.argmax(mmr))
+        yield chosen
+        available[chosen] = False
+        available &= similarity[chosen] < near_dup
+        redundancy = np.maximum(redundancy, similarity[chosen])
+
+
+def select_context(results, tokenizer=None, token_budget=RETRIEVAL_TOKEN_BUDGET, lambda_=MMR_LAMBDA, near_dup=NEAR_DUP_THRESHOLD):
+    """Turn index query results into a bullet list of diverse chunks within token_budget."""
+    tokenizer = tokenizer or default_tokenizer()
+    texts, scores, vectors = pool_matches(results)
+    if not texts:
+        return ""
+    lines = []
+    used = 0
+    for i in mmr_order(scores, vectors, lambda_, near_dup):
+        line = f"- {texts[i]}\n"
+        tokens = len(tokenizer.encode(line))
+        if used + tokens > token_budget:
+            # A shorter, lower-ranked chunk may still fit.
+            continue
+        lines.append(line)
+        used += tokens
+    logging.info(f"Selected {len(lines)} of {len(texts)} unique chunks ({used} tokens)")
+    return "".join(lines)
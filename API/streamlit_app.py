@@ -8,6 +8,7 @@ import logging
 from typing import Any, Dict, List
 from functions import vanilla_model_to_interpret_report
 from langchain_groq import ChatGroq
+from llm_cache import create_llm_cache
 import dotenv
 import os
 
@@ -26,7 +27,8 @@ OCR_API_URL = "http://localhost:8001/extract-lab-report"
 CHAT_API_URL = "http://localhost:8001/chat"
 chat1 = ChatGroq(
     api_key=GROQ_API_KEY,
-    model_name=model_name
+    model_name=model_name,
+    cache=create_llm_cache()
 )
 
 st.set_page_config(page_title="Medical Lab Report Interpreter", layout="wide")
@@ -0,0 +1,238 @@
+import csv
+import logging
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCRAPPER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scrapper")
+# CSVs written by testingLab_scrapper.scrape_test_page_content and scrapper.scrape_medlineplus.
+DEFAULT_SOURCES = [
+    os.path.join(SCRAPPER_DIR, "testing_scraped_content.csv"),
+    os.path.join(SCRAPPER_DIR, "medical_tests_interpretation.csv"),
+]
+TEST_NAME_SOURCES = [p for p in os.getenv("TEST_NAME_SOURCES", "").split(",") if p] or DEFAULT_SOURCES
+TEST_NAME_MATCH_THRESHOLD = float(os.getenv("TEST_NAME_MATCH_THRESHOLD", "0.8"))
+
+# Words that say nothing about which test it is: "CBC test" and "CBC" are the same lookup.
+GENERIC_WORDS = {"test", "tests", "testing", "lab", "labs", "report", "result", "results", "level", "levels", "the", "of", "a", "an"}
+# Specimen words a fuzzy match may add or drop: "Serum Ferritin" is the Ferritin test.
+SPECIMEN_WORDS = {"serum", "plasma", "blood"}
+# Two differing words are spelling variants ("haemoglobin", "hemoglobin") at this trigram similarity.
+SPELLING_VARIANT_SIMILARITY = 0.6
+
+BUILTIN_ALIASES = {
+    "Complete Blood Count": ["CBC", "Full Blood Count", "FBC", "Hemogram", "Haemogram", "CBC with differential"],
+    "Lipid Panel": ["Lipid Profile", "Cholesterol Test", "Lipid Test"],
+    "Comprehensive Metabolic Panel": ["CMP", "Chem 14"],
+    "Basic Metabolic Panel": ["BMP", "Chem 7"],
+    "Liver Panel": ["LFT", "Liver Function Test", "Hepatic Function Panel"],
+    "Thyroid Stimulating Hormone": ["TSH"],
+    "Hemoglobin A1c": ["HbA1c", "A1c", "Glycated Hemoglobin", "Glycosylated Hemoglobin"],
+    "Prothrombin Time and International Normalized Ratio": ["PT INR", "PT/INR", "Prothrombin Time", "INR"],
+    "Urinalysis": ["Urine Routine", "Urine Analysis", "Urine RE", "Urine Routine Examination"],
+    "Erythrocyte Sedimentation Rate": ["ESR", "Sed Rate"],
+    "C Reactive Protein": ["CRP"],
+    "Renal Function Panel": ["RFT", "Kidney Function Test", "Renal Function Test"],
+}
+
+
+def normalize_test_name(test_name):
+    """'Complete-Blood-Count ' -> 'complete blood count'."""
+    return re.sub(r"[\W_]+", " ", test_name or "").strip().lower()
+
+
+def match_key(test_name):
+    words = [w for w in normalize_test_name(test_name).split() if w not in GENERIC_WORDS]
+    return " ".join(words) or normalize_test_name(test_name)
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def spelling_variant(word, other):
+    grams, other_grams = trigrams(word), trigrams(other)
+    return 2 * len(grams & other_grams) / (len(grams) + len(other_grams)) >= SPELLING_VARIANT_SIMILARITY
+
+
+def same_test_words(key, alias_key):
+    """False when the words that differ name a different test.
+
+    Trigram scores stay high for "Troponin I"/"Troponin T", "Vitamin
+    B1"/"Vitamin B12" or "HIV 1"/"HIV 2 antibody", and for antibody vs
+    antigen. A fuzzy match is only kept when every differing word is a
+    specimen word or a spelling variant of a differing word on the other
+    side, and none of them is a short code or contains digits.
+    """
+    words, alias_words = set(key.split()), set(alias_key.split())
+    only_key, only_alias = words - alias_words, alias_words - words
+    for word in only_key | only_alias:
+        if word in SPECIMEN_WORDS:
+            continue
+        if len(word) < 3 or any(ch.isdigit() for ch in word):
+            return False
+        others = only_alias if word in only_key else only_key
+        if not any(spelling_variant(word, other) for other in others):
+            return False
+    return True
+
+
+def split_scraped_name(raw):
+    """Split a scraped title into (name, aliases).
+
+    MedlinePlus titles carry the abbreviation in parentheses ("Complete
+    Blood Count (CBC)"); testing.com names come from URL slugs and end
+    with it instead ("Complete Blood Count Cbc").
+    """
+    raw = (raw or "").strip()
+    aliases = [a.strip() for a in re.findall(r"\(([^)]*)\)", raw) if a.strip()]
+    name = re.sub(r"\s*\([^)]*\)", "", raw).strip()
+    words = name.split()
+    if len(words) > 2:
+        initials = "".join(w[0] for w in words[:-1]).lower()
+        if words[-1].lower() == initials:
+            aliases.append(words[-1])
+            name = " ".join(words[:-1])
+    return name, aliases
+
+
+class TestNameIndex:
+    """Alias table plus a character-trigram index over canonical test names.
+
+    Exact aliases are a dict lookup. Everything else goes through the
+    trigram postings, scored with Dice similarity on trigrams and on
+    word sets; results are memoized, so repeated names cost one dict hit.
+    Candidates whose differing words name another test (same_test_words)
+    are never returned, since the canonical ID keys stored summaries and
+    cached responses.
+    """
+
+    def __init__(self, threshold=TEST_NAME_MATCH_THRESHOLD, cache_size=4096):
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self.names = {}
+        self.aliases = {}
+        self.alias_keys = []
+        self.alias_ids = []
+        self.alias_sizes = []
+        self.postings = defaultdict(list)
+        self.resolved = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.alias_keys)
+
+    def add(self, name, aliases=()):
+        """Register a canonical name and its aliases; returns the canonical ID.
+
+        A name that is already a known alias joins the existing entry
+        instead of creating a new canonical test.
+        """
+        key = match_key(name)
+        if not key:
+            return None
+        canonical_id = self.aliases.get(key)
+        if canonical_id is None:
+            canonical_id = normalize_test_name(name)
+            self.names.setdefault(canonical_id, name)
+            self.add_alias(name, canonical_id)
+        for alias in aliases:
+            self.add_alias(alias, canonical_id)
+        return canonical_id
+
+    def add_alias(self, alias, canonical_id):
+        key = match_key(alias)
+        if not key or key in self.aliases:
+            return
+        self.aliases[key] = canonical_id
+        position = len(self.alias_keys)
+        grams = trigrams(key)
+        self.alias_keys.append(key)
+        self.alias_ids.append(canonical_id)
+        self.alias_sizes.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(position)
+        self.resolved.clear()
+
+    def add_scraped_name(self, raw):
+        name, aliases = split_scraped_name(raw)
+        return self.add(name, aliases) if name else None
+
+    def resolve(self, test_name):
+        """Return (canonical_id, score), or (None, best_score) below the threshold."""
+        key = match_key(test_name)
+        canonical_id = self.aliases.get(key)
+        if canonical_id is not None:
+            return canonical_id, 1.0
+        with self.lock:
+            if key in self.resolved:
+                self.resolved.move_to_end(key)
+                return self.resolved[key]
+        result = self._fuzzy(key)
+        with self.lock:
+            self.resolved[key] = result
+            while len(self.resolved) > self.cache_size:
+                self.resolved.popitem(last=False)
+        return result
+
+    def _fuzzy(self, key):
+        grams = trigrams(key)
+        overlaps = Counter()
+        for gram in grams:
+            overlaps.update(self.postings.get(gram, ()))
+        if not overlaps:
+            return None, 0.0
+        words = set(key.split())
+        best_id, best_score = None, 0.0
+        for position, shared in overlaps.most_common(20):
+            score = 2 * shared / (len(grams) + self.alias_sizes[position])
+            alias_words = set(self.alias_keys[position].split())
+            word_score = 2 * len(words & alias_words) / (len(words) + len(alias_words))
+            score = max(score, word_score)
+            if score > best_score and same_test_words(key, self.alias_keys[position]):
+                best_id, best_score = self.alias_ids[position], score
+        if best_score >= self.threshold:
+            return best_id, best_score
+        return None, best_score
+
+    def canonical_id(self, test_name):
+        """Canonical ID for storage keys; unknown tests fall back to their normalized name."""
+        canonical_id, score = self.resolve(test_name)
+        return canonical_id or normalize_test_name(test_name)
+
+    def canonical_name(self, canonical_id):
+        return self.names.get(canonical_id, canonical_id)
+
+
+def load_test_names_from_csv(path, column="Test Name"):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [row[column] for row in csv.DictReader(f) if row.get(column)]
+
+
+def build_default_index(sources=TEST_NAME_SOURCES):
+    index = TestNameIndex()
+    for name, aliases in BUILTIN_ALIASES.items():
+        index.add(name, aliases)
+    for path in sources:
+        if not os.path.exists(path):
+            continue
+        try:
+            names = load_test_names_from_csv(path)
+        except (OSError, KeyError, csv.Error) as e:
+            logging.error(f"Error loading test names from {path}: {e}")
+            continue
+        for raw in names:
+            index.add_scraped_name(raw)
+        logging.info(f"Loaded {len(names)} test names from {path}")
+    return index
+
+
+test_name_index = build_default_index()
+
+
+def canonical_test_id(test_name):
+    return test_name_index.canonical_id(test_name)
@@ -0,0 +1,81 @@
+"""Micro-benchmark: per-word chunk_text vs the single-pass token-window chunker.
+
+Runs both chunkers on real testing.com pages, either from the scraper's
+output CSV or fetched live, and reports time, chunk count and the largest
+chunk re-encoded on its own (the old per-word counts drift above the limit).
+
+    python Test_Files/bench_chunk_text.py --csv Scrapper/testing_scraped_content.csv --max-tokens 1000
+    python Test_Files/bench_chunk_text.py --urls https://www.testing.com/tests/complete-blood-count-cbc/
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "API"))
+
+import tiktoken
+from functions import chunk_text, clean_text, scrape_and_extract
+
+DEFAULT_URLS = [
+    "https://www.testing.com/tests/complete-blood-count-cbc/",
+    "https://www.testing.com/tests/lipid-panel/",
+    "https://www.testing.com/tests/comprehensive-metabolic-panel-cmp/",
+    "https://www.testing.com/tests/thyroid-panel/",
+]
+
+
+def chunk_text_per_word(text, tokenizer, max_tokens):
+    # The previous implementation, kept here as the baseline.
+    chunks, current_chunk, token_count = [], [], 0
+    for word in text.split():
+        word_tokens = len(tokenizer.encode(word))
+        if token_count + word_tokens > max_tokens:
+            chunks.append(" ".join(current_chunk))
+            current_chunk, token_count = [], 0
+        current_chunk.append(word)
+        token_count += word_tokens
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+    return chunks
+
+
+def load_pages(args):
+    if args.csv:
+        csv.field_size_limit(sys.maxsize)
+        with open(args.csv, newline="", encoding="utf-8") as f:
+            return [row["Content"] for row in csv.DictReader(f)][:args.limit]
+    return [clean_text(scrape_and_extract(url)) for url in args.urls]
+
+
+def run(name, chunker, pages, tokenizer, max_tokens):
+    start = time.perf_counter()
+    chunks = [chunk for page in pages for chunk in chunker(page, tokenizer, max_tokens)]
+    elapsed = (time.perf_counter() - start) * 1000
+    largest = max(len(tokenizer.encode(chunk)) for chunk in chunks)
+    print(f"{name:<22}{elapsed:>10.1f}{len(chunks):>10}{largest:>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", help="testing_scraped_content.csv from Scrapper/testingLab_scrapper.py")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--urls", nargs="+", default=DEFAULT_URLS)
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=100)
+    args = parser.parse_args()
+
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+    pages = [page for page in load_pages(args) if page]
+    total_tokens = sum(len(tokenizer.encode(page)) for page in pages)
+    print(f"{len(pages)} pages, {total_tokens} tokens, max_tokens={args.max_tokens}")
+    print(f"{'chunker':<22}{'ms':>10}{'chunks':>10}{'max tokens':>14}")
+    run("per-word", chunk_text_per_word, pages, tokenizer, args.max_tokens)
+    run("windows", lambda t, tok, m: chunk_text(t, tok, m, overlap=0, snap_to_sentences=False), pages, tokenizer, args.max_tokens)
+    run("windows + sentences", lambda t, tok, m: chunk_text(t, tok, m, overlap=0), pages, tokenizer, args.max_tokens)
+    run(f"+ overlap {args.overlap}", lambda t, tok, m: chunk_text(t, tok, m, overlap=args.overlap), pages, tokenizer, args.max_tokens)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Compare whole-page get_text() with main-content extraction on real pages.
+
+For each URL prints the tokens and chunks (i.e. extraction LLM calls) each
+cleaner produces, plus parse time.
+
+    python Test_Files/bench_clean_text.py --max-tokens 1000
+    python Test_Files/bench_clean_text.py --urls https://medlineplus.gov/lab-tests/complete-blood-count-cbc/
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "API"))
+
+import tiktoken
+from bs4 import BeautifulSoup
+from functions import chunk_text, clean_text, scrape_and_extract
+
+DEFAULT_URLS = [
+    "https://www.testing.com/tests/complete-blood-count-cbc/",
+    "https://medlineplus.gov/lab-tests/complete-blood-count-cbc/",
+    "https://www.mayoclinic.org/tests-procedures/complete-blood-count/about/pac-20384919",
+    "https://my.clevelandclinic.org/health/diagnostics/4053-complete-blood-count",
+]
+
+
+def clean_text_whole_page(text):
+    # The previous implementation, kept here as the baseline.
+    soup = BeautifulSoup(text, "html.parser")
+    return re.sub(r"\s+", " ", soup.get_text()).strip()
+
+
+def measure(cleaner, html, tokenizer, max_tokens):
+    start = time.perf_counter()
+    text = cleaner(html)
+    elapsed = (time.perf_counter() - start) * 1000
+    return len(tokenizer.encode(text)), len(chunk_text(text, tokenizer, max_tokens)), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", nargs="+", default=DEFAULT_URLS)
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    args = parser.parse_args()
+
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+    totals = {"whole page": [0, 0, 0.0], "main content": [0, 0, 0.0]}
+    print(f"{'url':<60}{'cleaner':<14}{'tokens':>8}{'chunks':>8}{'ms':>8}")
+    for url in args.urls:
+        html = scrape_and_extract(url)
+        if not html:
+            continue
+        for name, cleaner in (("whole page", clean_text_whole_page), ("main content", lambda h: clean_text(h, url))):
+            tokens, chunks, elapsed = measure(cleaner, html, tokenizer, args.max_tokens)
+            totals[name] = [totals[name][0] + tokens, totals[name][1] + chunks, totals[name][2] + elapsed]
+            print(f"{url[:58]:<60}{name:<14}{tokens:>8}{chunks:>8}{elapsed:>8.1f}")
+    for name, (tokens, chunks, elapsed) in totals.items():
+        print(f"{'total':<60}{name:<14}{tokens:>8}{chunks:>8}{elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
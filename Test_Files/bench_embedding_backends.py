@@ -0,0 +1,91 @@
+"""Encode latency, memory and parity of the query-encoder backends.
+
+Each backend is loaded in its own subprocess so the RSS numbers are not
+polluted by the others. Export the ONNX graphs first:
+
+    python API/embedding_backends.py export --out onnx_encoder
+    python Test_Files/bench_embedding_backends.py --model-dir onnx_encoder
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import numpy as np
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "API")
+sys.path.insert(0, API_DIR)
+
+from embedding_backends import PARITY_TEXTS
+
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def worker(backend, model_dir, runs):
+    from embedding_backends import load_embedding_model
+
+    baseline = rss_mb()
+    model = load_embedding_model(backend, model_dir)
+    loaded = rss_mb()
+    model.encode(PARITY_TEXTS[:2])  # warm up
+    timings = {}
+    for batch in (1, 2, 8):
+        texts = (PARITY_TEXTS * 2)[:batch]
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            model.encode(texts)
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[batch] = statistics.median(samples)
+    print(json.dumps({
+        "backend": backend,
+        "model_rss_mb": loaded - baseline,
+        "peak_rss_mb": rss_mb(),
+        "latency_ms": timings,
+        "embeddings": np.asarray(model.encode(PARITY_TEXTS)).tolist(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default="onnx_encoder")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--worker")
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker, args.model_dir, args.runs)
+        return
+
+    results = {}
+    for backend in BACKENDS:
+        output = subprocess.run(
+            [sys.executable, __file__, "--worker", backend, "--model-dir", args.model_dir, "--runs", str(args.runs)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        results[backend] = json.loads(output.strip().splitlines()[-1])
+
+    reference = np.asarray(results["torch"]["embeddings"])
+    print(f"{'backend':<11}{'b=1 ms':>9}{'b=2 ms':>9}{'b=8 ms':>9}{'model MB':>10}{'RSS MB':>9}{'min cos':>9}")
+    for backend in BACKENDS:
+        item = results[backend]
+        embeddings = np.asarray(item["embeddings"])
+        cosine = (reference * embeddings).sum(axis=1) / (
+            np.linalg.norm(reference, axis=1) * np.linalg.norm(embeddings, axis=1)
+        )
+        latency = item["latency_ms"]
+        print(f"{backend:<11}{latency['1']:>9.1f}{latency['2']:>9.1f}{latency['8']:>9.1f}"
+              f"{item['model_rss_mb']:>10.0f}{item['peak_rss_mb']:>9.0f}{cosine.min():>9.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Micro-benchmark: per-request encoding vs the micro-batching encoder.
+
+Simulates N concurrent pipelines, each encoding its two descriptions, and
+reports wall time and per-call latency with and without MicroBatchEncoder.
+
+    python Test_Files/bench_embedding_service.py --clients 16 --rounds 5 --wait-ms 3
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "API"))
+
+from embedding_backends import load_embedding_model
+from embedding_service import MicroBatchEncoder
+from bench_retrieve_context import DESCRIPTIONS
+
+
+def run(encoder, clients, rounds):
+    latencies = []
+
+    def one_pipeline(i):
+        start = time.perf_counter()
+        # Vary the text so nothing is served from a cache.
+        encoder.encode([f"{text} ({i})" for text in DESCRIPTIONS])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(one_pipeline, range(clients * rounds)))
+    wall = time.perf_counter() - start
+    return wall, statistics.median(latencies), sorted(latencies)[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--wait-ms", type=float, default=3)
+    parser.add_argument("--max-batch", type=int, default=32)
+    args = parser.parse_args()
+
+    model = load_embedding_model()
+    model.encode(DESCRIPTIONS)  # warm up
+    batched = MicroBatchEncoder(model, max_batch=args.max_batch, max_wait_ms=args.wait_ms)
+
+    print(f"{args.clients} concurrent clients x {args.rounds} rounds, {len(DESCRIPTIONS)} texts per call")
+    print(f"{'variant':<16}{'wall s':>10}{'median ms':>12}{'p95 ms':>10}")
+    for name, encoder in (("direct", model), ("micro-batched", batched)):
+        wall, median, p95 = run(encoder, args.clients, args.rounds)
+        print(f"{name:<16}{wall:>10.2f}{median:>12.1f}{p95:>10.1f}")
+    print(f"micro-batch stats: {batched.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Recall@k, latency and resident memory of the local index storage variants.
+
+Exact float32 search is the reference. Queries are rows of the corpus with
+Gaussian noise added (or, with --encode, real report descriptions encoded
+with the msmarco model), so the run needs nothing but a built index:
+
+    python API/local_index.py quantize local_index --storage int8
+    python API/local_index.py quantize local_index --storage float16
+    python Test_Files/bench_local_index.py local_index --queries 500
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "API"))
+
+from local_index import LocalIndex, QUANTIZED_FILES, GRAPH_FILE
+
+ENCODE_QUERIES = [
+    "Low hemoglobin and low mean corpuscular volume suggest iron deficiency anemia.",
+    "Elevated TSH with low free T4 is consistent with primary hypothyroidism.",
+    "High LDL cholesterol and low HDL cholesterol increase cardiovascular risk.",
+    "Raised ALT and AST indicate liver cell injury such as hepatitis.",
+    "Elevated creatinine and urea point to reduced kidney function.",
+    "HbA1c above 6.5 percent is diagnostic of diabetes mellitus.",
+]
+
+
+def make_queries(index, count, noise, encode):
+    if encode:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer("sentence-transformers/msmarco-bert-base-dot-v5")
+        return list(model.encode(ENCODE_QUERIES))
+    rng = np.random.default_rng(0)
+    rows = rng.choice(index.vectors.shape[0], size=count, replace=False)
+    base = np.asarray(index.vectors[rows], dtype=np.float32)
+    return list(base + noise * rng.standard_normal(base.shape).astype(np.float32) / np.sqrt(base.shape[1]))
+
+
+def run(index, queries, top_k, reference=None):
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = index.search(query, top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(set(int(r) for r in rows))
+    recall = None
+    if reference is not None:
+        recall = statistics.mean(len(got & want) / len(want) for got, want in zip(results, reference))
+    return results, recall, statistics.median(latencies), float(np.percentile(latencies, 99))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index_path")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--encode", action="store_true", help="use encoded report descriptions as queries")
+    args = parser.parse_args()
+
+    reference_index = LocalIndex(args.index_path)
+    # Pull the mapped matrix into the page cache so the baseline isn't measuring disk reads.
+    np.asarray(reference_index.vectors).sum()
+    queries = make_queries(reference_index, args.queries, args.noise, args.encode)
+    reference, _, median, p99 = run(reference_index, queries, args.top_k)
+
+    rows = [("float32 exact", 1.0, median, p99, reference_index.resident_bytes())]
+    variants = []
+    for storage in ("float16", "int8"):
+        if os.path.exists(os.path.join(args.index_path, QUANTIZED_FILES[storage])):
+            variants.append((f"{storage}", dict(storage=storage, rescore=1)))
+            variants.append((f"{storage} + rescore x4", dict(storage=storage, rescore=4)))
+    if os.path.exists(os.path.join(args.index_path, GRAPH_FILE)):
+        variants.append(("hnsw graph", dict(mode="graph")))
+
+    for name, kwargs in variants:
+        index = LocalIndex(args.index_path, **kwargs)
+        _, recall, median, p99 = run(index, queries, args.top_k, reference)
+        rows.append((name, recall, median, p99, index.resident_bytes()))
+
+    print(f"{reference_index.info['count']} vectors, {len(queries)} queries, recall@{args.top_k} vs float32 exact")
+    print(f"{'variant':<24}{'recall':>8}{'p50 ms':>9}{'p99 ms':>9}{'resident MB':>13}")
+    for name, recall, median, p99, size in rows:
+        print(f"{name:<24}{recall:>8.3f}{median:>9.2f}{p99:>9.2f}{size / 2**20:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Micro-benchmark: per-description retrieval vs aretrieve_context_batch.
+
+Uses the real msmarco encoder and a stand-in index that sleeps for a
+configurable round trip, so the numbers isolate what the batching and the
+concurrent queries buy us without needing Pinecone credentials.
+
+    python Test_Files/bench_retrieve_context.py --rtt-ms 40 --runs 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "API"))
+
+from sentence_transformers import SentenceTransformer
+import functions
+from async_functions import aretrieve_context_batch
+
+
+class SleepyIndex:
+    def __init__(self, rtt_ms):
+        self.rtt = rtt_ms / 1000
+
+    def query(self, vector, top_k, include_metadata=True, **kwargs):
+        time.sleep(self.rtt)
+        return {"matches": [{"id": str(i), "score": 0.0, "metadata": {"text": ""}} for i in range(top_k)]}
+
+
+def retrieve_context_sequential(description, embedding_model, index, top_k):
+    # The pre-batching implementation, kept here as the baseline.
+    results = []
+    for desc in description:
+        query_vector = embedding_model.encode(desc).tolist()
+        results.append(index.query(vector=query_vector, top_k=top_k, include_metadata=True))
+    return results
+
+
+DESCRIPTIONS = [
+    "The complete blood count shows low hemoglobin and hematocrit with a low mean corpuscular volume, "
+    "a pattern consistent with microcytic anemia such as iron deficiency anemia.",
+    "White blood cell count is mildly elevated with neutrophilia, which can indicate a bacterial infection "
+    "or inflammation; platelet count is within the normal reference range.",
+]
+
+
+def timed(func, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rtt-ms", type=float, default=40)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    model = SentenceTransformer("sentence-transformers/msmarco-bert-base-dot-v5")
+    index = SleepyIndex(args.rtt_ms)
+    model.encode(DESCRIPTIONS)  # warm up
+
+    def batched():
+        asyncio.run(aretrieve_context_batch([DESCRIPTIONS], model, index, args.top_k))
+
+    def cold_batched():
+        functions._embedding_cache.clear()
+        batched()
+
+    rows = [
+        ("sequential", timed(lambda: retrieve_context_sequential(DESCRIPTIONS, model, index, args.top_k), args.runs)),
+        ("batched (cold cache)", timed(cold_batched, args.runs)),
+        ("batched (warm cache)", timed(batched, args.runs)),
+    ]
+    print(f"{len(DESCRIPTIONS)} descriptions, index RTT {args.rtt_ms:.0f} ms, {args.runs} runs")
+    print(f"{'variant':<24}{'median ms':>12}{'max ms':>12}")
+    for name, (median, worst) in rows:
+        print(f"{name:<24}{median:>12.1f}{worst:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Evaluate the local reranker against the LLM discard stage.
+
+For every report the web summary and vector context are fetched once, then
+both context filters run on the same inputs:
+
+    llm       adiscard_irrelevant_context + final answer
+    <kind>    rerank_context (embedding or cross-encoder) + final answer
+
+It prints filter and end-to-end latency, context size and the cosine
+similarity of the two final interpretations (query encoder), and writes
+every pair to --out so they can be read side by side. Needs the same .env
+as the API.
+
+    cd API && python ../Test_Files/eval_context_filter.py --reports reports.jsonl --reranker embedding
+
+reports.jsonl holds one {"test_name", "report", "disease"} object per line;
+without it a few built-in reports are used.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "API"))
+
+import numpy as np
+import chatBot_final as api
+from async_functions import aVDB_search, afilter_context, agenerate_final_output
+from rerank import create_reranker
+
+SAMPLE_REPORTS = [
+    {"test_name": "Complete Blood Count", "disease": "anemia",
+     "report": "Hemoglobin: 9.1 g/dL (13.5-17.5); Hematocrit: 29% (41-53); MCV: 68 fL (80-100); WBC: 6.2 x10^9/L (4.5-11.0); Platelets: 310 x10^9/L (150-450)"},
+    {"test_name": "Lipid Profile", "disease": "heart disease",
+     "report": "Total cholesterol: 262 mg/dL (<200); LDL: 181 mg/dL (<100); HDL: 34 mg/dL (>40); Triglycerides: 236 mg/dL (<150)"},
+    {"test_name": "Thyroid Function Test", "disease": "fatigue",
+     "report": "TSH: 8.9 mIU/L (0.4-4.0); Free T4: 0.6 ng/dL (0.8-1.8); Free T3: 2.1 pg/mL (2.3-4.2)"},
+    {"test_name": "Kidney Function Test", "disease": "",
+     "report": "Creatinine: 2.1 mg/dL (0.7-1.3); BUN: 38 mg/dL (7-20); eGFR: 34 mL/min/1.73m2 (>90)"},
+]
+
+
+async def run_path(item, web_results, vector_results, generated_text, reranker):
+    start = time.perf_counter()
+    context = await afilter_context(item["test_name"], None, vector_results, item["report"], web_results, api.router.client("discard"), reranker)
+    filtered = time.perf_counter()
+    answer = await agenerate_final_output(item["report"], item["test_name"], item["disease"], generated_text, context, api.router.client("final"))
+    done = time.perf_counter()
+    return {
+        "filter_ms": (filtered - start) * 1000,
+        "total_ms": (done - start) * 1000,
+        "context_tokens": len(api.tokenizer.encode(context)),
+        "answer": answer,
+    }
+
+
+def cosine(a, b):
+    vectors = np.asarray(api.embedding_model.encode([a, b]), dtype=np.float32)
+    return float(vectors[0] @ vectors[1] / max(np.linalg.norm(vectors[0]) * np.linalg.norm(vectors[1]), 1e-12))
+
+
+async def evaluate(items, reranker_kind):
+    reranker = create_reranker(api.embedding_model, reranker_kind)
+    rows = []
+    for item in items:
+        web_results = await api.lookup_web_summary(item["test_name"])
+        if web_results is None:
+            web_results = await api.search_web_summary(item["test_name"])
+        vector_results, generated_text = await aVDB_search(
+            item["test_name"], item["report"], api.router.client("refined"), item["disease"], api.embedding_model, api.index, top_k=5
+        )
+        llm = await run_path(item, web_results, vector_results, generated_text, None)
+        local = await run_path(item, web_results, vector_results, generated_text, reranker)
+        rows.append({"test_name": item["test_name"], "llm": llm, reranker_kind: local,
+                     "answer_similarity": cosine(llm["answer"], local["answer"])})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reports", help="JSONL file of reports to evaluate")
+    parser.add_argument("--reranker", choices=["embedding", "cross-encoder"], default="embedding")
+    parser.add_argument("--out", default="context_filter_eval.jsonl")
+    args = parser.parse_args()
+
+    items = SAMPLE_REPORTS
+    if args.reports:
+        with open(args.reports) as f:
+            items = [json.loads(line) for line in f if line.strip()]
+    rows = asyncio.run(evaluate(items, args.reranker))
+
+    with open(args.out, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+    print(f"{len(rows)} reports, answers written to {args.out}")
+    print(f"{'path':<16}{'filter ms':>12}{'total ms':>12}{'ctx tokens':>12}")
+    for path in ("llm", args.reranker):
+        print(f"{path:<16}"
+              f"{statistics.median(r[path]['filter_ms'] for r in rows):>12.0f}"
+              f"{statistics.median(r[path]['total_ms'] for r in rows):>12.0f}"
+              f"{statistics.median(r[path]['context_tokens'] for r in rows):>12.0f}")
+    similarities = [r["answer_similarity"] for r in rows]
+    print(f"answer similarity: median {statistics.median(similarities):.3f}, min {min(similarities):.3f}")
+
+
+if __name__ == "__main__":
+    main()